@@ -1,9 +1,11 @@
+import fnmatch
 import os
+import re
 import sys
-import ctypes
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional
+from typing import Callable, Optional
 
 from colorama import Fore, Style
 import stat
@@ -16,6 +18,8 @@ FILE_ATTRIBUTE_SYSTEM   = 0x4
 
 
 valid_flags = {'-a', '-r', '-l', '-d', '-s'}
+long_options = ('--jobs=', '--exclude=', '--max-depth=')
+long_flags = {'--prune-hidden-dirs', '--follow-symlinks', '--one-file-system'}
 
 
 @dataclass
@@ -23,6 +27,12 @@ class FlagsPath:
     path: str=None
     flags: list[str]=None
     another_path: str=None
+    jobs: int=1
+    exclude: Optional[Callable]=None
+    max_depth: Optional[int]=None
+    prune_hidden_dirs: bool=False
+    follow_symlinks: bool=False
+    one_file_system: bool=False
 
 @dataclass
 class Information:
@@ -30,10 +40,6 @@ class Information:
     directory: Optional[str] = None
 
 
-current_info: Information=None
-current_path_flags: FlagsPath = None
-
-
 class CheckArgv:
 
 
@@ -46,6 +52,39 @@ class CheckArgv:
         __path = '.'
         return __path
 
+    @staticmethod
+    def jobs(argv: list) -> int:
+        for arg in argv:
+            if arg.startswith('--jobs='):
+                try:
+                    jobs = int(arg[len('--jobs='):])
+                except ValueError:
+                    raise TypeError(f"invalid value for --jobs: {arg}")
+                if jobs < 1:
+                    raise TypeError(f"invalid value for --jobs: {arg}")
+                return jobs
+        return 1
+
+    @staticmethod
+    def exclude(argv: list) -> Optional[Callable]:
+        patterns = [arg[len('--exclude='):] for arg in argv if arg.startswith('--exclude=')]
+        if not patterns:
+            return None
+        return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns)).match
+
+    @staticmethod
+    def max_depth(argv: list) -> Optional[int]:
+        for arg in argv:
+            if arg.startswith('--max-depth='):
+                try:
+                    depth = int(arg[len('--max-depth='):])
+                except ValueError:
+                    raise TypeError(f"invalid value for --max-depth: {arg}")
+                if depth < 0:
+                    raise TypeError(f"invalid value for --max-depth: {arg}")
+                return depth
+        return None
+
     @staticmethod
     def get_another_path(argv: list) -> Optional[str]:
         for arg in reversed(argv):
@@ -77,6 +116,8 @@ class CheckArgv:
     def split_argv(argv: list):
         new_argv = []
         for arg in argv:
+            if arg.startswith(long_options) or arg in long_flags:
+                continue
             if arg.startswith("-"):
                 if len(arg) == 2:
                     new_argv.append(arg)
@@ -101,56 +142,113 @@ class CheckArgv:
         self.get_another_path(argv)
         self.check_argv(argv)
         self.split_argv(argv)
-        return FlagsPath(self._path(argv), self.split_argv(argv), self.get_another_path(argv))
+        return FlagsPath(self._path(argv), self.split_argv(argv), self.get_another_path(argv), self.jobs(argv),
+                         self.exclude(argv), self.max_depth(argv), '--prune-hidden-dirs' in argv,
+                         '--follow-symlinks' in argv, '--one-file-system' in argv)
 
 
 
 
 class FilesInfo:
+
+    def __init__(self, path_flags: FlagsPath):
+        self.path_flags = path_flags
     @staticmethod
     def os_listing(path):
         return os.listdir(path)
 
     @staticmethod
-    def visible_files():
-        visible = []
-        for name in os.listdir(current_path_flags.path):
-            full_path = os.path.join(current_path_flags.path, name)
-            attrs = ctypes.windll.kernel32.GetFileAttributesW(str(full_path))
-            if attrs != -1 and not (attrs & FILE_ATTRIBUTE_HIDDEN):
-                visible.append(name)
-        return visible
-
+    def is_hidden(entry):
+        if os.name == 'nt':
+            return bool(entry.stat().st_file_attributes & FILE_ATTRIBUTE_HIDDEN)
+        return entry.name.startswith('.')
 
-    @staticmethod
-    def _filtering(path, base='.'):
-        all_files = os.listdir(path)
-        for file in all_files:
-            _filename = os.path.splitext(os.path.basename(file))[0]
-            if _filename :
+    def visible_files(self):
+        return self._filtering(self.path_flags.path)[0]
 
+    def _pruned(self, entry):
+        """True for entries --exclude or --prune-hidden-dirs drop while the directory is read."""
+        if self.path_flags.exclude and self.path_flags.exclude(entry.name):
+            return True
+        return self.path_flags.prune_hidden_dirs and entry.is_dir() and self.is_hidden(entry)
 
-    def also_hidden_files(self):
-        return self.os_listing(current_path_flags.path)
+    def _filtering(self, path):
+        visible = []
+        hidden = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if self._pruned(entry):
+                    continue
+                if self.is_hidden(entry):
+                    hidden.append(entry.name)
+                else:
+                    visible.append(entry.name)
+        return visible, hidden
 
+    def _listing(self, path):
+        if not self.path_flags.exclude and not self.path_flags.prune_hidden_dirs:
+            return self.os_listing(path)
+        with os.scandir(path) as entries:
+            return [entry.name for entry in entries if not self._pruned(entry)]
 
-    def _subfiles(self, list_of_files: list, base=None):
-        base = base or current_path_flags.path
-        items = []
-        for name in list_of_files:
-            full_path = os.path.join(base, name)
-            if os.path.isdir(full_path):
-                sub = self._subfiles(self.os_listing(full_path), full_path)
-                items.append([name, sub])
-            else:
-                items.append(name)
-        return items
+    def also_hidden_files(self):
+        return self._listing(self.path_flags.path)
+
+
+    def _descend(self, full_path, visited):
+        if not os.path.isdir(full_path):
+            return False
+        if os.path.islink(full_path) and not self.path_flags.follow_symlinks:
+            return False
+        st = os.stat(full_path)
+        if self.path_flags.one_file_system and st.st_dev != visited['device']:
+            return False
+        key = (st.st_dev, st.st_ino)
+        if key in visited['seen']:
+            return False
+        visited['seen'].add(key)
+        return True
+
+    def _subfiles(self, list_of_files: list, base=None, pool=None, depth=0, visited=None):
+        base = base or self.path_flags.path
+        if visited is None:
+            root = os.stat(base)
+            visited = {'device': root.st_dev, 'seen': {(root.st_dev, root.st_ino)}}
+        if pool is None and self.path_flags.jobs > 1:
+            with ThreadPoolExecutor(max_workers=self.path_flags.jobs) as pool:
+                return self._subfiles(list_of_files, base, pool, depth, visited)
+        max_depth = self.path_flags.max_depth
+        top = []
+        # Explicit stack of (folder, its names or the pending listing, depth, list to fill): any depth fits.
+        stack = [(base, list_of_files, depth, top)]
+        while stack:
+            base, names, depth, items = stack.pop()
+            if names is None:
+                names = self._listing(base)
+            elif not isinstance(names, list):
+                names = names.result()
+            listings = {}
+            if max_depth is None or depth < max_depth:
+                for name in names:
+                    full_path = os.path.join(base, name)
+                    if self._descend(full_path, visited):
+                        listings[name] = pool.submit(self._listing, full_path) if pool else None
+            sub_folders = []
+            for name in names:
+                if name in listings:
+                    sub = []
+                    items.append([name, sub])
+                    sub_folders.append((os.path.join(base, name), listings[name], depth + 1, sub))
+                else:
+                    items.append(name)
+            stack.extend(reversed(sub_folders))
+        return top
 
 
     def return_according_flags(self):
-        a = ('-a' in current_path_flags.flags)
-        r = ('-r' in current_path_flags.flags)
-        d = ('-d' in current_path_flags.flags)
+        a = ('-a' in self.path_flags.flags)
+        r = ('-r' in self.path_flags.flags)
+        d = ('-d' in self.path_flags.flags)
         if not d:
             base_list = self.also_hidden_files() if a else self.visible_files()
             if r:
@@ -158,26 +256,37 @@ class FilesInfo:
             else:
                 return Information(info=base_list)
         else:
-            return Information(directory=current_path_flags.another_path)
+            return Information(directory=self.path_flags.another_path)
 
 
 class Printing:
 
+    def __init__(self, path_flags: FlagsPath, info: Information, stream=None):
+        self.path_flags = path_flags
+        self.info = info
+        self.stream = stream
+
     @staticmethod
     def _files_details(path_file):
         st = os.stat(path_file)
         dt = time.localtime(st.st_mtime)
         date_s = time.strftime("%d/%m/%Y", dt)
         time_s = time.strftime("%H:%M", dt)
-        size_s =
+        size_s = f'{st.st_size}'
         perm = stat.filemode(st.st_mode)
-        return f'[{date_s} {time_s} | {perm}]'
+        return f'[{date_s} {time_s} | {size_s} | {perm}]'
 
     def final_printing_indent(self, list_flags, base=None, indent=1):
-        l = ('-l' in current_path_flags.flags)
-        base = base or current_path_flags.path
-        _indent = ' ' * indent
-        for item in list_flags:
+        l = ('-l' in self.path_flags.flags)
+        base = base or self.path_flags.path
+        stack = [(base, indent, iter(list_flags))]
+        while stack:
+            base, indent, items = stack[-1]
+            item = next(items, None)
+            if item is None:
+                stack.pop()
+                continue
+            _indent = ' ' * indent
             if isinstance(item ,str):
                 full = os.path.join(base, item)
                 if os.path.isdir(full):
@@ -185,62 +294,52 @@ class Printing:
                 else:
                     line = f'{Style.RESET_ALL}{item}'
                 if l:
-                    print(f'{_indent}{line}{self._files_details(full)}')
+                    print(f'{_indent}{line}{self._files_details(full)}', file=self.stream)
                 else:
-                    print(f'{_indent}{line}')
+                    print(f'{_indent}{line}', file=self.stream)
             else:
                 folder_name, sub_folder = item
                 _full = os.path.join(base, folder_name)
                 line = f'{Fore.BLUE + folder_name}{Style.RESET_ALL}'
                 if l:
-                    print(f'{_indent}{line}{self._files_details(_full)}')
+                    print(f'{_indent}{line}{self._files_details(_full)}', file=self.stream)
                 else:
-                    print(f'{_indent}{line}')
-                Printing().final_printing_indent(sub_folder, os.path.join(base, folder_name), indent + 4)
+                    print(f'{_indent}{line}', file=self.stream)
+                stack.append((_full, indent + 4, iter(sub_folder)))
 
     def final_printing_regaler(self, base='.', end=' '):
-        base = base or current_path_flags.path
-        l = ('-l' in current_path_flags.flags)
-        for item in current_info.info:
+        base = base or self.path_flags.path
+        l = ('-l' in self.path_flags.flags)
+        for item in self.info.info:
             foll_path = os.path.join(base, item)
             if os.path.isdir(os.path.join(base,item)):
                 line = f'{Fore.BLUE}{item}{Style.RESET_ALL}'
             else:
                 line  = f'{Style.RESET_ALL}{item}'
             if l:
-                print(f'{line} {self._files_details(foll_path)}')
+                print(f'{line} {self._files_details(foll_path)}', file=self.stream)
             else:
-                print(line, end=' ')
+                print(line, end=' ', file=self.stream)
 
     def printing(self):
-        d = ('-d' in current_path_flags.flags)
-        r = ('-r' in current_path_flags.flags)
+        d = ('-d' in self.path_flags.flags)
+        r = ('-r' in self.path_flags.flags)
         if not d:
             if r:
-                self.final_printing_indent(current_info.info, current_path_flags.path)
+                self.final_printing_indent(self.info.info, self.path_flags.path)
             else:
-                self.final_printing_regaler(current_path_flags.path)
+                self.final_printing_regaler(self.path_flags.path)
         else:
-            filename_without_ext = os.path.splitext(os.path.basename(current_info.directory))[0]
-            print(f'{filename_without_ext} {self._files_details(current_info.directory)}')
+            filename_without_ext = os.path.splitext(os.path.basename(self.info.directory))[0]
+            print(f'{filename_without_ext} {self._files_details(self.info.directory)}', file=self.stream)
 
 
-def main():
-    global current_path_flags, current_info
-    check = CheckArgv()
-    current_path_flags = check.call_all_func(sys.argv[1:])
-    info = FilesInfo()
-    current_info = info.return_according_flags()
-    Printing().printing()
+def main(argv: Optional[list]=None, stream=None):
+    """Lists argv (sys.argv by default) onto stream; all state lives in the call, so calls may overlap."""
+    argv = sys.argv if argv is None else argv
+    path_flags = CheckArgv().call_all_func(argv[1:])
+    info = FilesInfo(path_flags).return_according_flags()
+    Printing(path_flags, info, stream).printing()
 if __name__ == '__main__':
     main()
 
-@staticmethod
-    def from_file_to_str(files: list[File])->list[str]:
-        str_files = []
-        for name in files:
-            if isinstance(name, File):
-                str_files.append(str(name))
-            elif isinstance(name, Folder):
-                str_files.append(str(name.folder_details))
-        return str_files
\ No newline at end of file
@@ -0,0 +1,417 @@
+"""
+Benchmarks the three listing implementations (ls_python.py, ls.py, Is2.py) on
+reproducible synthetic trees and flags regressions against a stored baseline.
+
+    python benchmark.py                    # run and print the results
+    python benchmark.py --save-baseline    # store the results as the new baseline
+    python benchmark.py --compare          # exit 1 if a case regressed against the baseline
+    python benchmark.py --latency-ms 2     # also compare ls_python's engines on a simulated slow mount
+    python benchmark.py --compare --import-budget-ms 40   # also fail if ls_python starts up slower
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Callable, Iterator, Optional
+
+import Is2
+import ls
+import ls_python
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Slowdowns smaller than this are timer noise, whatever the ratio.
+MIN_WALL_DELTA = 0.002
+
+# Import budget of ls_python in a fresh interpreter, in milliseconds.
+IMPORT_BUDGET_MS = 60
+
+# Modules a plain ls_python listing piped to another program must not import.
+LAZY_MODULES = ('colorama', 'ctypes', 'asyncio', 'concurrent.futures', 'sqlite3', 'tarfile', 'zipfile')
+
+STARTUP_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import ls_python
+elapsed = time.perf_counter() - start
+ls_python.main(['ls_python.py', '-l', sys.argv[1]])
+print(elapsed, *[name for name in sys.argv[2:] if name in sys.modules], file=sys.stderr)
+'''
+
+FLAG_SETS = [[], ['-l'], ['-R'], ['-a'], ['-S'], ['-i'], ['-l', '-R'], ['-a', '-l', '-R']]
+
+# Flags each implementation understands, mapped from the ls_python spelling.
+IMPLEMENTATION_FLAGS = {
+    'ls_python': {'-l': '-l', '-R': '-R', '-a': '-a', '-S': '-S', '-i': '-i'},
+    'ls': {'-l': '-l', '-R': '-r', '-a': '-a'},
+    'Is2': {'-l': '-l', '-R': '-r', '-a': '-a'},
+}
+
+
+class TreeBuilder:
+    """Creates the synthetic trees; the same seed always gives the same tree."""
+
+    def __init__(self, root: str, scale: int=1, seed: int=0):
+        self.root = root
+        self.scale = scale
+        self.random = random.Random(seed)
+
+    def write_file(self, path: str, size: int)->None:
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+
+    def wide(self)->str:
+        path = os.path.join(self.root, 'wide')
+        os.makedirs(path)
+        for i in range(2000 * self.scale):
+            self.write_file(os.path.join(path, f'file{i:06}.txt'), self.random.randint(0, 64))
+        return path
+
+    def deep(self)->str:
+        path = os.path.join(self.root, 'deep')
+        current = path
+        for i in range(50 * self.scale):
+            current = os.path.join(current, f'd{i}')
+            os.makedirs(current)
+            self.write_file(os.path.join(current, 'leaf'), i)
+        return path
+
+    def hidden(self)->str:
+        path = os.path.join(self.root, 'hidden')
+        os.makedirs(path)
+        for i in range(1000 * self.scale):
+            name = f'.hidden{i}' if i % 3 else f'visible{i}'
+            self.write_file(os.path.join(path, name), 1)
+        return path
+
+    def mixed(self)->str:
+        path = os.path.join(self.root, 'mixed')
+        self.mixed_level(path, 0)
+        return path
+
+    def mixed_level(self, path: str, depth: int)->None:
+        os.makedirs(path)
+        for i in range(self.random.randint(5, 20 * self.scale)):
+            size = self.random.choice([0, 10, 1000, 100_000]) + self.random.randint(0, 99)
+            prefix = '.' if self.random.random() < 0.1 else ''
+            self.write_file(os.path.join(path, f'{prefix}f{i}.{self.random.choice(["py", "txt", "bin"])}'), size)
+        if depth < 4:
+            for i in range(self.random.randint(1, 4)):
+                self.mixed_level(os.path.join(path, f'dir{i}'), depth + 1)
+
+    def build(self)->dict[str, str]:
+        return {'wide': self.wide(), 'deep': self.deep(), 'hidden': self.hidden(), 'mixed': self.mixed()}
+
+
+class CountedEntry:
+    """DirEntry that counts the stat it makes the first time a result needs one.
+
+    Like CPython's DirEntry it keeps one stat per kind (of the link, of its target):
+    names, inodes and type checks come from the listing and cost nothing, unless a
+    check follows a symlink.
+    """
+
+    def __init__(self, entry: os.DirEntry, counter: 'SyscallCounter'):
+        self.entry = entry
+        self.counter = counter
+        self.stated = set()
+        self.name = entry.name
+        self.path = entry.path
+
+    def __getattr__(self, name: str):
+        return getattr(self.entry, name)
+
+    def count_stat(self, follow_symlinks: bool)->None:
+        kind = follow_symlinks and self.entry.is_symlink()
+        if kind not in self.stated:
+            self.stated.add(kind)
+            self.counter.count += 1
+
+    def stat(self, *, follow_symlinks=True)->os.stat_result:
+        self.count_stat(follow_symlinks)
+        return self.entry.stat(follow_symlinks=follow_symlinks)
+
+    def is_dir(self, *, follow_symlinks=True)->bool:
+        if follow_symlinks and self.entry.is_symlink():
+            self.count_stat(True)
+        return self.entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_file(self, *, follow_symlinks=True)->bool:
+        if follow_symlinks and self.entry.is_symlink():
+            self.count_stat(True)
+        return self.entry.is_file(follow_symlinks=follow_symlinks)
+
+
+class CountedScandir:
+    """The iterator of os.scandir, handing out CountedEntry."""
+
+    def __init__(self, iterator, counter: 'SyscallCounter'):
+        self.iterator = iterator
+        self.counter = counter
+
+    def __enter__(self)->'CountedScandir':
+        return self
+
+    def __exit__(self, *exc_info)->None:
+        self.iterator.close()
+
+    def __iter__(self)->Iterator[CountedEntry]:
+        return (CountedEntry(entry, self.counter) for entry in self.iterator)
+
+    def close(self)->None:
+        self.iterator.close()
+
+
+class SyscallCounter:
+    """Counts the file system syscalls a listing makes while active.
+
+    These are the os calls (os.path helpers go through os.stat and os.lstat) and
+    the stats a DirEntry makes when first asked for one, so an implementation
+    that stats through scandir entries is counted like one calling os.stat.
+    Type checks are taken as answered by the listing, as they are on Linux file
+    systems that report the entry type.
+    """
+
+    names = ('stat', 'lstat', 'listdir')
+
+    def __init__(self):
+        self.count = 0
+        self.originals = {}
+
+    def wrap(self, function: Callable)->Callable:
+        def counted(*args, **kwargs):
+            self.count += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def scandir(self, function: Callable)->Callable:
+        def counted(*args, **kwargs):
+            self.count += 1
+            return CountedScandir(function(*args, **kwargs), self)
+        return counted
+
+    @contextmanager
+    def active(self)->Iterator['SyscallCounter']:
+        self.originals = {name: getattr(os, name) for name in (*self.names, 'scandir')}
+        for name in self.names:
+            setattr(os, name, self.wrap(self.originals[name]))
+        os.scandir = self.scandir(self.originals['scandir'])
+        try:
+            yield self
+        finally:
+            for name, function in self.originals.items():
+                setattr(os, name, function)
+
+
+@contextmanager
+def silenced_stdout()->Iterator[None]:
+    stdout = sys.stdout
+    sys.stdout = io.TextIOWrapper(open(os.devnull, 'wb'), encoding='utf-8')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def run_ls_python(path: str, flags: list[str])->None:
+    ls_python.main(['ls_python.py', *flags, path])
+
+
+def run_ls(path: str, flags: list[str])->None:
+    command = ls.Parser().parse_user_command(['ls.py', *flags, path])
+    files = ls.GetInfo().execute_command(command)
+    ls.Printer().print(files, command)
+
+
+def run_is2(path: str, flags: list[str])->None:
+    Is2.main(['Is2.py', *flags, path])
+
+
+RUNNERS = {'ls_python': run_ls_python, 'ls': run_ls, 'Is2': run_is2}
+
+
+@dataclass
+class Result:
+    implementation: str
+    tree: str
+    flags: str
+    wall: Optional[float] = None
+    syscalls: Optional[int] = None
+    peak_memory: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def key(self)->str:
+        return f'{self.implementation} {self.tree} {self.flags or "(none)"}'
+
+
+def measure(name: str, tree: str, path: str, flags: list[str], repeat: int)->Result:
+    runner = RUNNERS[name]
+    result = Result(implementation=name, tree=tree, flags=' '.join(flags))
+    try:
+        with silenced_stdout():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                runner(path, flags)
+                timings.append(time.perf_counter() - start)
+            counter = SyscallCounter()
+            with counter.active():
+                runner(path, flags)
+            tracemalloc.start()
+            try:
+                runner(path, flags)
+                result.peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+        return result
+    result.wall = min(timings)
+    result.syscalls = counter.count
+    return result
+
+
+def run_all(trees: dict[str, str], repeat: int, implementations: list[str])->list[Result]:
+    results = []
+    for name in implementations:
+        supported = IMPLEMENTATION_FLAGS[name]
+        for tree, path in trees.items():
+            for flag_set in FLAG_SETS:
+                if any(flag not in supported for flag in flag_set):
+                    continue
+                results.append(measure(name, tree, path, [supported[flag] for flag in flag_set], repeat))
+    return results
+
+
+# ls_python collection engines compared on a LatencyFS.
+ENGINES = {
+    'serial': lambda fs: ls_python.ScanInfoProvide(fs=fs),
+    'threads': lambda fs: ls_python.ParallelScanInfoProvide(8, fs=fs),
+    'asyncio': lambda fs: ls_python.AsyncInfoProvide(fs=fs),
+}
+
+
+def latency_results(path: str, latency: float, repeat: int)->dict[str, float]:
+    args = ls_python.Args(path=path, flags=[ls_python.Flags.recursive, ls_python.Flags.size,
+                                            ls_python.Flags.time, ls_python.Flags.permission])
+    results = {}
+    for name, engine in ENGINES.items():
+        timings = []
+        for _ in range(repeat):
+            info = engine(ls_python.LatencyFS(latency=latency))
+            start = time.perf_counter()
+            for _batch in info.iter_batches(path, args):
+                pass
+            timings.append(time.perf_counter() - start)
+        results[name] = min(timings)
+    return results
+
+
+@dataclass
+class Startup:
+    import_time: float
+    loaded: list[str]
+
+
+def startup(path: str, repeat: int)->Startup:
+    """Fastest import of ls_python over fresh interpreters, and the lazy modules a piped -l listing loaded."""
+    best = None
+    for _ in range(repeat + 1):
+        process = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, path, *LAZY_MODULES],
+                                 cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+        elapsed, *loaded = process.stderr.split()
+        if best is None or float(elapsed) < best.import_time:
+            best = Startup(float(elapsed), loaded)
+    return best
+
+
+def startup_problems(result: Startup, budget_ms: float)->list[str]:
+    found = []
+    if result.import_time * 1000 > budget_ms:
+        found.append(f'ls_python import {result.import_time * 1000:.2f} ms over the {budget_ms:g} ms budget')
+    if result.loaded:
+        found.append(f'ls_python plain listing imported {", ".join(result.loaded)}')
+    return found
+
+
+def report(results: list[Result])->None:
+    print(f'{"case":<32}{"wall ms":>10}{"syscalls":>10}{"peak KiB":>10}')
+    for result in results:
+        if result.error:
+            print(f'{result.key:<32}  error: {result.error}')
+        else:
+            print(f'{result.key:<32}{result.wall * 1000:>10.2f}{result.syscalls:>10}{result.peak_memory // 1024:>10}')
+
+
+def regressions(results: list[Result], baseline: dict, threshold: float)->list[str]:
+    found = []
+    for result in results:
+        base = baseline.get(result.key)
+        if base is None or result.error or base.get('error'):
+            continue
+        if result.wall > base['wall'] * (1 + threshold) and result.wall - base['wall'] > MIN_WALL_DELTA:
+            found.append(f'{result.key}: wall {base["wall"] * 1000:.2f} ms -> {result.wall * 1000:.2f} ms')
+        if result.syscalls > base['syscalls']:
+            found.append(f'{result.key}: syscalls {base["syscalls"]} -> {result.syscalls}')
+        if result.peak_memory > base['peak_memory'] * (1 + threshold):
+            found.append(f'{result.key}: peak memory {base["peak_memory"]} -> {result.peak_memory}')
+    return found
+
+
+def main(argv: list)->int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=int, default=1, help='multiplies the size of every synthetic tree')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case, the fastest is kept')
+    parser.add_argument('--implementation', action='append', choices=list(RUNNERS),
+                        help='limit the run to these implementations')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown before a case is flagged')
+    parser.add_argument('--latency-ms', type=float, help='per-call latency of the simulated slow mount')
+    parser.add_argument('--import-budget-ms', type=float, default=IMPORT_BUDGET_MS,
+                        help='slowest accepted import of ls_python')
+    options = parser.parse_args(argv[1:])
+
+    root = tempfile.mkdtemp(prefix='ls-bench-')
+    try:
+        trees = TreeBuilder(root, options.scale, options.seed).build()
+        results = run_all(trees, options.repeat, options.implementation or list(RUNNERS))
+        slow_mount = latency_results(trees['mixed'], options.latency_ms / 1000, options.repeat) \
+            if options.latency_ms else {}
+        started = startup(trees['mixed'], options.repeat)
+    finally:
+        shutil.rmtree(root)
+    report(results)
+    for name, wall in slow_mount.items():
+        print(f'{"latency mixed -l -R " + name:<32}{wall * 1000:>10.2f}')
+    print(f'{"startup ls_python import":<32}{started.import_time * 1000:>10.2f}')
+
+    if options.save_baseline:
+        with open(options.baseline, 'w') as f:
+            json.dump({result.key: asdict(result) for result in results}, f, indent=1)
+    if options.compare:
+        with open(options.baseline) as f:
+            found = regressions(results, json.load(f), options.threshold)
+        found += startup_problems(started, options.import_budget_ms)
+        for line in found:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
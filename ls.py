@@ -1,19 +1,20 @@
 """
 Ls
 """
-import ctypes
 import os
 import stat
 import sys
 import time
-from typing import List, Union, Dict
+from functools import lru_cache
+from typing import Callable, FrozenSet, List, Set, Tuple, Union, Dict
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from colorama import Fore, Style
 
 
 FILE_SYS = Dict[str, list[Union[str, Dict]]]
+FILE_ATTRIBUTE_HIDDEN = 0x2
 
 
 class Flags(Enum):
@@ -28,6 +29,8 @@ class Flags(Enum):
 class Command:
     path: str
     flags: list[Flags]
+    # Entries the listing saw are folders, spelled as the printer receives them.
+    folders: Set[str] = field(default_factory=set)
 
 
 class Parser:
@@ -98,36 +101,67 @@ class GetInfo:
 
 
     def recursive(self, command: Command) -> FILE_SYS:
+        st = os.stat(command.path)
+        visited = {(st.st_dev, st.st_ino)}
         files = {command.path: []}
-        for path in list(self._get_list_dir(command)):
-            if os.path.isdir(path):
-                new_command = Command(path, command.flags)
-                files[command.path].append(self.recursive(new_command))
-            else:
-                files[command.path].append(path)
-                return files
+        # Explicit stack of (folder, its list in files), so the depth is not bound by the recursion limit.
+        stack = [(command.path, files[command.path])]
+        while stack:
+            folder, entries = stack.pop()
+            listed = Command(folder, command.flags)
+            for name in self._get_list_dir(listed):
+                path = os.path.join(folder, name)
+                if name in listed.folders:
+                    command.folders.add(path)
+                else:
+                    entries.append(path)
+                    continue
+                if name not in (".", "..") and not os.path.islink(path) and self._first_visit(path, visited):
+                    sub_folder = {path: []}
+                    entries.append(sub_folder)
+                    stack.append((path, sub_folder[path]))
+                else:
+                    entries.append(path)
         return files
 
+    @staticmethod
+    def _first_visit(path: str, visited: Set[Tuple[int, int]]) -> bool:
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino)
+        if key in visited:
+            return False
+        visited.add(key)
+        return True
+
     def directory(self, command: Command) -> FILE_SYS:
         command.flags.append(Flags.l)
         command.flags.remove(Flags.c)
+        if os.path.isdir(command.path):
+            command.folders.add(command.path)
         return {command.path: [command.path]}
 
     def _get_list_dir(self, command: Command) -> List[str]:
         if os.path.isdir(command.path):
-            if Flags.a in command.flags:
-                files = os.listdir(command.path)
-                files = self._remove_not_exists(command.path, files)
-                self._add_reference_folders(files)
-            else:
-                files = list(filter(lambda f: not self._check_file_attributes(f, 0x2), os.listdir(command.path)))
+            with os.scandir(command.path) as entries:
+                if Flags.a in command.flags:
+                    entries = list(entries)
+                    files = self._remove_not_exists(command.path, [entry.name for entry in entries])
+                    self._add_reference_folders(files)
+                    command.folders.update((".", ".."))
+                else:
+                    entries = [entry for entry in entries if not self._is_hidden(entry)]
+                    files = [entry.name for entry in entries]
+                # The listing already knows which entries are folders: printing never stats for colors.
+                command.folders.update(entry.name for entry in entries if entry.is_dir())
             return list(sorted(files))
 
         raise FileNotFoundError(command.path)
 
     @staticmethod
-    def _check_file_attributes(file_path: str, attribute: int) -> bool:
-        return ctypes.windll.kernel32.GetFileAttributesW(file_path) & attribute
+    def _is_hidden(entry: os.DirEntry) -> bool:
+        if os.name == "nt":
+            return bool(entry.stat().st_file_attributes & FILE_ATTRIBUTE_HIDDEN)
+        return entry.name.startswith(".")
 
     @staticmethod
     def _remove_not_exists(path: str, files: List[str]) -> List[str]:
@@ -157,48 +191,64 @@ class Printer:
         self.print_folder(file_sys, 0, command)
 
     def print_folder(self, folder: FILE_SYS, depth: int, command) -> None:
-        files = list(folder.values())[0]
-        for file in files:
+        file_info = self._compile_file_info(frozenset(command.flags))
+        stack = [iter(list(folder.values())[0])]
+        while stack:
+            file = next(stack[-1], None)
+            if file is None:
+                stack.pop()
+                continue
             if isinstance(file, str):
-                file = self._get_file_info(Command(file, command.flags))
+                file = file_info(file, file in command.folders)
                 print(f"{file}", end="")
             else:
                 print(f"{list(file.keys())[0]}")
-                self.print_folder(file, depth + 1, command)
+                stack.append(iter(list(file.values())[0]))
 
     def _get_file_info(self, command: Command) -> str:
-        file_info = ""
+        return self._compile_file_info(frozenset(command.flags))(command.path, command.path in command.folders)
 
-        if Flags.c in command.flags:
-            file_info += f"{self.color_file(command.path)} "
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def _compile_file_info(flags: FrozenSet[Flags]) -> Callable[[str, bool], str]:
+        """Resolves the flags once into the formatter applied to every path and whether it is a folder."""
+        if Flags.c in flags:
+            name = lambda path, is_dir: f"{Printer.color_file(path, is_dir)} "
         else:
-            file_info += f"{command.path:}"
+            name = lambda path, is_dir: path
 
-        if Flags.l in command.flags:
-            file_info = f"{file_info:<24}"
-            file_info += f"{self._get_file_stamp(command.path):<20}"
-            file_info += f"{self._get_file_permissions(command.path):>20}"
-            file_info += f"{self._get_file_size(command.path):>20}"
-            file_info += "\n"
+        if Flags.l not in flags:
+            return name
 
-        return file_info
+        def long_info(path: str, is_dir: bool) -> str:
+            st = os.stat(path)
+            return (f"{name(path, is_dir):<24}{Printer._get_file_stamp(st):<20}"
+                    f"{Printer._get_file_permissions(st):>20}{Printer._get_file_size(st):>20}\n")
+        return long_info
 
-    def color_file(self, path: str) -> str:
-        if os.path.isdir(path):
+    @staticmethod
+    def color_file(path: str, is_dir: bool) -> str:
+        if is_dir:
             return Fore.BLUE + path + Style.RESET_ALL
         return Fore.LIGHTWHITE_EX + path + Style.RESET_ALL
 
     @staticmethod
-    def _get_file_stamp(file_path: str) -> str:
-        return time.strftime("%d-%m-%Y %H:%M:%S", time.localtime(os.stat(file_path).st_mtime))
+    @lru_cache(maxsize=4096)
+    def _format_minute(minute: int) -> str:
+        return time.strftime("%d-%m-%Y %H:%M", time.localtime(minute * 60))
+
+    @staticmethod
+    def _get_file_stamp(st: os.stat_result) -> str:
+        seconds = int(st.st_mtime)
+        return f"{Printer._format_minute(seconds // 60)}:{seconds % 60:02d}"
 
     @staticmethod
-    def _get_file_permissions(file_path: str) -> str:
-        return stat.filemode(os.stat(file_path).st_mode)
+    def _get_file_permissions(st: os.stat_result) -> str:
+        return stat.filemode(st.st_mode)
 
     @staticmethod
-    def _get_file_size(file_path: str) -> str:
-        return str(os.stat(file_path).st_size)
+    def _get_file_size(st: os.stat_result) -> str:
+        return str(st.st_size)
 
 if __name__ == '__main__':
     parser = Parser()
@@ -0,0 +1,88 @@
+"""
+Thin client of `ls_python.py --serve`: sends one listing to the daemon and copies its output here.
+
+    python ls_python.py --serve=/tmp/ls.sock &
+    python ls_client.py --connect=/tmp/ls.sock -l -R src     # or set LS_PYTHON_SOCKET
+
+Only these standard modules are imported, so a listing costs an interpreter
+start and one round trip instead of a cold ls_python import and cold stats.
+When no daemon answers, the listing runs in-process.
+
+Protocol: the client sends one JSON line {"argv", "cwd", "interactive",
+"environ"}; the daemon answers with frames of a channel u8 and payload length
+u32 header, stdout and stderr bytes as they are produced and last the exit
+status.
+"""
+import json
+import os
+import socket
+import struct
+import sys
+from typing import Optional
+
+frame_header = struct.Struct('<BI')
+STATUS, STDOUT, STDERR = 0, 1, 2
+
+# Variables of the client's environment a listing depends on: colors, time zone and cache.
+environ_names = ('LS_COLORS', 'TZ', 'LS_PYTHON_CACHE')
+
+# Options that run where they were given: a daemon of its own, and a listing redrawn on this terminal.
+local_options = ('--serve', '--watch')
+
+
+def send_frame(connection: socket.socket, channel: int, payload: bytes)->None:
+    connection.sendall(frame_header.pack(channel, len(payload)) + payload)
+
+
+def socket_path(argv: list)->Optional[str]:
+    for index, arg in enumerate(argv):
+        if arg.startswith('--connect='):
+            return arg[len('--connect='):]
+        if arg == '--connect' and index + 1 < len(argv):
+            return argv[index + 1]
+    return os.environ.get('LS_PYTHON_SOCKET')
+
+
+def servable(argv: list)->bool:
+    return not any(arg.startswith(local_options) for arg in argv)
+
+
+def request(path: str, argv: list)->Optional[int]:
+    """Runs argv on the daemon listening at path and returns its exit status, None when no daemon answers."""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        connection.close()
+        return None
+    with connection:
+        message = {'argv': argv, 'cwd': os.getcwd(), 'interactive': sys.stdout.isatty(),
+                   'environ': {name: os.environ.get(name) for name in environ_names}}
+        connection.sendall(json.dumps(message).encode() + b'\n')
+        replies = connection.makefile('rb')
+        outputs = {STDOUT: sys.stdout.buffer, STDERR: sys.stderr.buffer}
+        while True:
+            header = replies.read(frame_header.size)
+            if len(header) < frame_header.size:
+                sys.stderr.write('ls_client: the daemon closed the connection\n')
+                return 1
+            channel, size = frame_header.unpack(header)
+            payload = replies.read(size)
+            if channel == STATUS:
+                return payload[0]
+            outputs[channel].write(payload)
+            outputs[channel].flush()
+
+
+def main(argv: list)->None:
+    path = socket_path(argv)
+    status = request(path, argv) if path and servable(argv) else None
+    if status is None:
+        import ls_python
+        ls_python.main(argv)
+        return
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,13 +1,28 @@
 import os
 import sys
-from dataclasses import dataclass, replace as dc_replace
-from pathlib import Path
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field, replace as dc_replace
 from enum import Enum
-import ctypes
-from typing import Optional, Union
-from colorama import Style, Fore
+from contextlib import contextmanager
+import fnmatch
+import functools
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, Optional, Union
 import stat
 import time
+from collections import OrderedDict, deque
+import heapq
+import itertools
+import operator
+import re
+import json
+import threading
+import select
+import struct
+import io
+
+# asyncio, concurrent.futures, sqlite3, tarfile, zipfile and ctypes are
+# imported where first needed: a plain listing piped to another program loads none of them.
 
 
 class Flags(Enum):
@@ -26,6 +41,15 @@ class Flags(Enum):
     inode = 'file id'
     S = 'dort by size'
     recursive = 'recursive'
+    no_cache = 'no listing cache'
+    watch = 'live listing'
+    reverse = 'reverse order'
+    total = 'recursive total size'
+    asyncio = 'asyncio collection'
+    prune_hidden_dirs = 'skip hidden folders'
+    follow_symlinks = 'descend into linked folders'
+    one_file_system = 'stay on the root device'
+    dedup = 'list hard links once'
 
 short_to_long = {
     'a': 'all',
@@ -37,46 +61,292 @@ short_to_long = {
     'c': 'c',
     'i': 'inode',
     'S': 'S',
-    'R': 'recursive'}
+    'R': 'recursive',
+    'r': 'reverse'}
+
+# Sort keys of --sort; sizes and times sort largest / newest first.
+sort_keys = {
+    'size': lambda f: -f.size,
+    'time': lambda f: -f.time,
+    'name': lambda f: f.filename,
+    'extension': lambda f: os.path.splitext(f.filename)[1]}
+
+
+def sort_option(value: str)->list[str]:
+    keys = value.split(',')
+    for key in keys:
+        if key not in sort_keys:
+            raise ValueError(f'unknown sort key {key}')
+    return keys
+
+
+valued_options = {
+    'jobs': int,
+    'cache': str,
+    'stats': str,
+    'sort': sort_option,
+    'head': int,
+    'format': str,
+    'exclude': str,
+    'max_depth': int,
+    'save_snapshot': str,
+    'from_snapshot': str,
+    'serve': str,
+    'connect': str}
+
+# Options naming files, resolved against the client's directory when a daemon serves the listing.
+path_options = ('cache', 'save_snapshot', 'from_snapshot')
+
+# Options that may be given several times; their values are collected in a list.
+repeated_options = {'exclude'}
+
+# Value of an option given without '=value'.
+option_defaults = {
+    'stats': 'text'}
 
 @dataclass
 class Args:
     path: str
     flags: list[Flags]
+    paths: list[str] = field(default_factory=list)
+    jobs: int = 1
+    cache: Optional[str] = None
+    stats: Optional[str] = None
+    sort: Optional[list[str]] = None
+    head: Optional[int] = None
+    format: str = 'text'
+    exclude: Optional[list[str]] = None
+    max_depth: Optional[int] = None
+    save_snapshot: Optional[str] = None
+    from_snapshot: Optional[str] = None
+    serve: Optional[str] = None
+    connect: Optional[str] = None
+    environ: Optional[dict] = None
 
+    def getenv(self, name: str)->Optional[str]:
+        """A variable of the environment the listing is for: a daemon's client's, or this process's."""
+        return (os.environ if self.environ is None else self.environ).get(name)
 
-@dataclass
+    @functools.cached_property
+    def plan(self)->'ListingPlan':
+        return ListingPlan.compile(frozenset(self.flags), self.getenv('LS_COLORS'), self.getenv('TZ'))
+
+    @functools.cached_property
+    def excluded(self)->Optional[Callable[[str], Optional[re.Match]]]:
+        """All --exclude globs compiled into one regex, matched against entry names."""
+        if not self.exclude:
+            return None
+        return re.compile('|'.join(fnmatch.translate(pattern) for pattern in self.exclude)).match
+
+
+@lru_cache(maxsize=4096)
+def format_minute(minute: int, zone: Optional['datetime.tzinfo']=None)->str:
+    if zone is None:
+        return time.strftime('[%d/%m/%Y, %H:%M]', time.localtime(minute * 60))
+    from datetime import datetime
+    return datetime.fromtimestamp(minute * 60, zone).strftime('[%d/%m/%Y, %H:%M]')
+
+
+def format_time(time_ns: int, zone: Optional['datetime.tzinfo']=None)->str:
+    """Times are shown at minute resolution, so every file of the same minute shares one strftime.
+
+    zone is None for this process's local time.
+    """
+    return format_minute(time_ns // 60_000_000_000, zone)
+
+
+@lru_cache(maxsize=None)
+def time_zone(tz: Optional[str])->Optional['datetime.tzinfo']:
+    """The zone a TZ value names, None when it is this process's own TZ.
+
+    A daemon's client may run under another TZ; an unset TZ means the system
+    zone, and one the zone database does not know is shown as UTC.
+    """
+    if tz == os.environ.get('TZ'):
+        return None
+    from datetime import timezone
+    from zoneinfo import ZoneInfo
+    try:
+        if tz:
+            return ZoneInfo(tz.lstrip(':'))
+        with open('/etc/localtime', 'rb') as f:
+            return ZoneInfo.from_file(f)
+    except (OSError, ValueError, LookupError):
+        return timezone.utc
+
+
+@dataclass(slots=True)
 class File:
-    inode: Optional[str]
+    """Raw stat values of one entry, formatted only when printed.
+
+    time holds the nanoseconds of the requested kind (mtime, or ctime/atime with -c/-u).
+    total is the cumulative size of a folder's subtree, set with --total.
+    kind holds the file type bits known at collection (the whole st_mode when
+    LS_COLORS colors by permission bits), set when output is colored.
+    link is the (st_dev, st_ino) of a file with other hard links, set under --dedup.
+    """
+    inode: Optional[int]
     full_path: Optional[str]
     filename: str
-    size: Optional[str]
-    time: Optional[str]
-    permission: Optional[str]
+    size: Optional[int]
+    time: Optional[int]
+    mode: Optional[int]
+    total: Optional[int] = None
+    kind: Optional[int] = None
+    link: Optional[tuple[int, int]] = None
 
     def __str__(self)->str:
         str_to_print = ""
-        if self.inode:
+        if self.inode is not None:
             str_to_print = f'{self.inode}'
         str_to_print += f'{self.filename}'
-        if self.size:
+        if self.size is not None:
             str_to_print += f' {self.size}'
-        if self.time:
-            str_to_print += f' {self.time}'
-        if self.permission:
-            str_to_print += f' {self.permission}'
+        if self.time is not None:
+            str_to_print += f' {format_time(self.time)}'
+        if self.mode is not None:
+            str_to_print += f' {stat.filemode(self.mode)}'
+        if self.total is not None:
+            str_to_print += f' [total {self.total}]'
         return str_to_print
 
 
 @dataclass
 class Folder:
+    """A listed folder; visit is its (st_dev, st_ino), taken at collection when the listing is recursive."""
     folder_details: Optional[File]
     files_details: Optional[list[Union['Folder',File]]]
+    visit: Optional[tuple[int, int]] = None
+
+
+@dataclass
+class Batch(Folder):
+    depth: int = 0
+    total: Optional[int] = None
+
+
+class Walk:
+    """(st_dev, st_ino) of everything one recursive walk has entered.
+
+    A folder reached a second time, through a symlink or bind mount loop or a
+    repeated subtree, is never scanned again; with --dedup a hard-linked file is
+    listed once. Only the printing side marks it, listing by listing in print
+    order, so every engine enters the same folders and keeps the same link.
+    Every listing starts a new Walk, so nothing carries over to the next.
+    """
+
+    def __init__(self, root: Optional[os.stat_result]=None):
+        self.seen = set()
+        self.device = None
+        if root is not None:
+            self.seen.add(self.key(root))
+            self.device = root.st_dev
+
+    @staticmethod
+    def key(st: os.stat_result)->tuple[int, int]:
+        return st.st_dev, st.st_ino
+
+    def first_visit(self, key: tuple[int, int])->bool:
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+
+# Bit of every flag in a ListingPlan mask.
+flag_bits = {flag: 1 << index for index, flag in enumerate(Flags)}
+
+# Stat field behind the time shown for -c, -u and by default.
+time_attributes = {Flags.c: 'st_ctime_ns', Flags.u: 'st_atime_ns', None: 'st_mtime_ns'}
+
+
+def flag_mask(flags: Iterable[Flags])->int:
+    mask = 0
+    for flag in flags:
+        mask |= flag_bits[flag]
+    return mask
+
+
+def no_value(_source)->None:
+    return None
+
+
+@dataclass(frozen=True)
+class ListingPlan:
+    """The flags of a listing resolved once.
+
+    mask answers per-directory flag tests with one AND; fetchers (inode from the
+    entry, size, time and mode from its stat) and the compiled make_file and
+    format_file closures run per entry without testing any flag.
+    """
+    mask: int
+    time_flag: Optional[Flags]
+    needs_stat: bool
+    fetchers: tuple[Callable, Callable, Callable, Callable]
+    row_end: str
+    make_file: Callable[[os.DirEntry], File]
+    format_file: Callable[[File], str]
+    palette: Optional['LsColors'] = None
+
+    def has(self, flag: Flags)->bool:
+        return bool(self.mask & flag_bits[flag])
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def compile(flags: frozenset, ls_colors: Optional[str]=None, tz: Optional[str]=None)->'ListingPlan':
+        time_flag = Flags.c if Flags.c in flags else Flags.u if Flags.u in flags else None
+        fetchers = (operator.methodcaller('inode') if Flags.inode in flags else no_value,
+                    operator.attrgetter('st_size') if Flags.size in flags else no_value,
+                    operator.attrgetter(time_attributes[time_flag]) if Flags.time in flags else no_value,
+                    operator.attrgetter('st_mode') if Flags.permission in flags else no_value)
+        palette = LsColors.from_spec(ls_colors) if Flags.color in flags else None
+        kind = palette.kind_fetcher() if palette else no_value
+        needs_stat = Flags.size in flags or Flags.time in flags or Flags.permission in flags or \
+            bool(palette and palette.modes)
+        return ListingPlan(mask=flag_mask(flags), time_flag=time_flag, needs_stat=needs_stat, fetchers=fetchers,
+                           row_end='\n' if Flags.one in flags else ' ',
+                           make_file=ListingPlan.file_maker(needs_stat, fetchers, Flags.follow_symlinks in flags,
+                                                            kind),
+                           format_file=ListingPlan.formatter(flags, time_zone(tz) if Flags.time in flags else None),
+                           palette=palette)
+
+    @staticmethod
+    def file_maker(needs_stat: bool, fetchers: tuple, follow_symlinks: bool,
+                   kind: Callable[[os.DirEntry], Optional[int]]=no_value)->Callable[[os.DirEntry], File]:
+        inode, size, time_ns, mode = fetchers
+        if not needs_stat:
+            return lambda entry: File(inode(entry), entry.path, entry.name, None, None, None, kind=kind(entry))
+
+        def make_file(entry: os.DirEntry)->File:
+            # A dangling or looping link is listed as the link itself.
+            st = entry_stat(entry) if follow_symlinks else entry.stat(follow_symlinks=False)
+            return File(inode(entry), entry.path, entry.name, size(st), time_ns(st), mode(st), kind=kind(entry))
+        return make_file
+
+    @staticmethod
+    def formatter(flags: frozenset, zone: Optional['datetime.tzinfo']=None)->Callable[[File], str]:
+        """Same text as File.__str__, with the parts chosen once instead of per record."""
+        parts = []
+        if Flags.inode in flags:
+            parts.append(lambda f: f'{f.inode}')
+        parts.append(operator.attrgetter('filename'))
+        if Flags.size in flags:
+            parts.append(lambda f: f' {f.size}')
+        if Flags.time in flags:
+            parts.append(lambda f: f' {format_time(f.time, zone)}')
+        if Flags.permission in flags:
+            parts.append(lambda f: f' {stat.filemode(f.mode)}')
+        if Flags.total in flags:
+            parts.append(lambda f: '' if f.total is None else f' [total {f.total}]')
+        if len(parts) == 1:
+            return parts[0]
+        return lambda f: ''.join([part(f) for part in parts])
 
 
 class CheckFlags:
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def conflict_flags() -> dict:
         conflict_flags = {}
         conflict_flags[Flags.one] =  [Flags.zero]
@@ -94,12 +364,21 @@ class CheckFlags:
         conflict_flags[Flags.inode] = []
         conflict_flags[Flags.S] = []
         conflict_flags[Flags.recursive] = [Flags.zero]
+        conflict_flags[Flags.no_cache] = []
+        conflict_flags[Flags.watch] = []
+        conflict_flags[Flags.reverse] = []
+        conflict_flags[Flags.total] = [Flags.zero]
+        conflict_flags[Flags.asyncio] = []
+        conflict_flags[Flags.prune_hidden_dirs] = []
+        conflict_flags[Flags.follow_symlinks] = []
+        conflict_flags[Flags.one_file_system] = []
+        conflict_flags[Flags.dedup] = []
         return conflict_flags
 
     @staticmethod
     def to_flag(name: str)->Flags:
         try:
-            return Flags[name]
+            return Flags[name.replace('-', '_')]
         except KeyError:
             raise ValueError(f'Unknown flag {name}')
 
@@ -116,6 +395,8 @@ class CheckFlags:
             dependant_flags += [Flags.size]
         if Flags.recursive in flags:
             dependant_flags += [Flags.one]
+        if Flags.total in flags:
+            dependant_flags += [Flags.size, Flags.recursive, Flags.one]
         return dependant_flags
 
     def dependant_flags(self, flags: list[Flags])->list[Flags]:
@@ -141,12 +422,15 @@ class CheckFlags:
 
 class AutoFlags:
 
-        def __init__(self, check_flags: CheckFlags):
+        def __init__(self, check_flags: CheckFlags, interactive: Optional[bool]=None):
             self.check_flags = check_flags
+            self.interactive = interactive
 
-        @staticmethod
-        def default_flags() -> list[Flags]:
-            return [Flags.color, Flags.zero]
+        def default_flags(self) -> list[Flags]:
+            interactive = sys.stdout.isatty() if self.interactive is None else self.interactive
+            if interactive:
+                return [Flags.color, Flags.zero]
+            return [Flags.zero]
 
         def get_auto_flags(self, flags: list[Flags]) -> list[Flags]:
             default_flags = self.default_flags()
@@ -166,7 +450,10 @@ class Argv:
 
     @staticmethod
     def valid_path(path: str)->bool:
-        return Path(path).exists()
+        if os.path.exists(path):
+            return True
+        archive_path = split_archive_path(path)
+        return archive_path is not None and open_archive(archive_path[0]).contains(archive_path[1])
 
     def get_double_dash_flags(self, args: list)->list[Flags]:
         valid_double_flags = []
@@ -190,146 +477,1489 @@ class Argv:
                 one_dash_flags.append(in_flag)
         return one_dash_flags
 
+    @staticmethod
+    def get_valued_options(argv: list)->tuple[dict, list]:
+        options = {}
+        rest = []
+        args = iter(argv)
+        for arg in args:
+            name, sep, value = arg[2:].partition('=')
+            key = name.replace('-', '_')
+            if not arg.startswith('--') or key not in valued_options:
+                rest.append(arg)
+                continue
+            if not sep and key in option_defaults:
+                value = option_defaults[key]
+            elif not sep:
+                value = next(args, None)
+                if value is None:
+                    raise ValueError(f'missing value for --{name}')
+            try:
+                converted = valued_options[key](value)
+            except ValueError:
+                raise ValueError(f'invalid value {value} for --{name}')
+            if key in repeated_options:
+                options.setdefault(key, []).append(converted)
+            else:
+                options[key] = converted
+        if options.get('jobs', 1) < 1:
+            raise ValueError(f'invalid value {options["jobs"]} for --jobs')
+        if options.get('head', 0) < 0:
+            raise ValueError(f'invalid value {options["head"]} for --head')
+        if options.get('max_depth', 0) < 0:
+            raise ValueError(f'invalid value {options["max_depth"]} for --max-depth')
+        if options.get('format', 'text') not in ('text', 'ndjson', 'binary'):
+            raise ValueError(f'invalid value {options["format"]} for --format')
+        if options.get('stats', 'text') not in ('text', 'json'):
+            raise ValueError(f'invalid value {options["stats"]} for --stats')
+        return options, rest
+
     def get_folder_name(self, path: str)->str:
         if not self.valid_path(path):
             raise ValueError(f'invalid path {path}')
         else:
             return path
 
-    def get_flags(self, argv: list)->list[Flags]:
+    @staticmethod
+    def option_flags(options: dict)->list[Flags]:
+        option_flags = []
+        if 'size' in options.get('sort', []):
+            option_flags.append(Flags.size)
+        if 'time' in options.get('sort', []):
+            option_flags.append(Flags.time)
+        if options.get('format', 'text') != 'text':
+            option_flags += [Flags.size, Flags.time, Flags.permission, Flags.inode]
+        if 'max_depth' in options:
+            option_flags.append(Flags.recursive)
+        return option_flags
+
+    def get_flags(self, argv: list, options: Optional[dict]=None)->list[Flags]:
         current_flags = self.get_one_dash_flags(argv)
         current_flags.extend(self.get_double_dash_flags(argv))
+        for flag in self.option_flags(options or {}):
+            if flag not in current_flags:
+                current_flags.append(flag)
         current_flags.extend(self.check_flags.dependant_flags(current_flags))
         current_flags.extend(self.default_flags.get_auto_flags(current_flags))
         return list(set(current_flags))
 
-    def parse_argv(self, argv: list)->Args:
-        if len(argv) > 1 and not argv[-1].startswith("-"):
-            path = self.get_folder_name(argv[-1])
-        else:
-            path = str(Path.cwd())
-        argv1 = Args(path=path, flags=self.get_flags(argv))
+    def parse_argv(self, argv: list, cwd: Optional[str]=None, environ: Optional[dict]=None)->Args:
+        """cwd and environ are the directory relative paths name and the environment, when not this process's own."""
+        options, argv = self.get_valued_options(argv)
+        if cwd is not None:
+            argv = [argv[0], *(arg if arg.startswith('-') else os.path.join(cwd, arg) for arg in argv[1:])]
+            for key in path_options:
+                if key in options:
+                    options[key] = os.path.join(cwd, options[key])
+            if environ and environ.get('LS_PYTHON_CACHE'):
+                environ = {**environ, 'LS_PYTHON_CACHE': os.path.join(cwd, environ['LS_PYTHON_CACHE'])}
+        snapshot = SnapshotFS(options['from_snapshot']) if 'from_snapshot' in options else None
+        # Paths of a snapshot are looked up in the snapshot, never on the live file system.
+        paths = [snapshot.resolve(arg) if snapshot else self.get_folder_name(arg)
+                 for arg in argv[1:] if not arg.startswith("-")]
+        if not paths:
+            paths = [snapshot.root if snapshot else cwd or os.getcwd()]
+        if snapshot:
+            snapshot.close()
+        argv1 = Args(path=paths[0], flags=self.get_flags(argv, options), paths=paths, environ=environ, **options)
+        if Flags.watch in argv1.flags and argv1.format != 'text':
+            raise ValueError(f'--watch redraws text, not --format={argv1.format}')
         return argv1
 
 
+class Stats:
+    """Wall time per phase and I/O counters of one listing."""
+
+    def __init__(self):
+        self.phases = {}
+        self.dir_reads = 0
+        self.stat_calls = 0
+        self.entries = 0
+        self.bytes_written = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str)->Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def add(self, dir_reads=0, stat_calls=0)->None:
+        with self.lock:
+            self.dir_reads += dir_reads
+            self.stat_calls += stat_calls
+
+    def as_dict(self)->dict:
+        return {'phases': self.phases, 'dir_reads': self.dir_reads, 'stat_calls': self.stat_calls,
+                'entries': self.entries, 'bytes_written': self.bytes_written}
+
+    def report(self, kind: str, stream=None)->None:
+        stream = stream or sys.stderr
+        if kind == 'json':
+            stream.write(json.dumps(self.as_dict()) + '\n')
+            return
+        for name, seconds in self.phases.items():
+            stream.write(f'{name:<10}{seconds * 1000:>10.2f} ms\n')
+        stream.write(f'dir reads {self.dir_reads}, stat calls {self.stat_calls}, '
+                     f'entries {self.entries}, bytes written {self.bytes_written}\n')
+
+
 FILE_ATTRIBUTE_HIDDEN = 0x2
 
-class InfoProvide:
+
+class HiddenCheck(ABC):
+    """Decides whether a directory entry is hidden, using only what scandir already holds."""
 
     @staticmethod
-    def get_vision_files(path: str)->list[str]:
-        visible = []
-        for name in os.listdir(path):
-            full_path = os.path.join(path, name)
-            attrs = ctypes.windll.kernel32.GetFileAttributesW(str(full_path))
-            if attrs != -1 and not (attrs & FILE_ATTRIBUTE_HIDDEN):
-                visible.append(name)
-        return visible
+    @abstractmethod
+    def is_hidden(entry: os.DirEntry)->bool:
+        pass
+
+
+class DotfileHidden(HiddenCheck):
 
     @staticmethod
-    def only_hidden(path: str)->list[str]:
-        hidden = []
-        for name in os.listdir(path):
-            full_path = os.path.join(path, name)
-            attrs = ctypes.windll.kernel32.GetFileAttributesW(str(full_path))
-            if  attrs != -1 and (attrs & FILE_ATTRIBUTE_HIDDEN):
-                hidden.append(name)
-        return hidden
-
-    @staticmethod
-    def only_folders(path: str)->list[str]:
-        folders = []
-        for name in os.listdir(path):
-            full_path = os.path.join(path, name)
-            if os.path.isdir(full_path):
-                folders.append(name)
-        return folders
-
-    @staticmethod
-    def get_size(path : str)->str:
-        st = os.stat(path)
-        return f"{st.st_size:}"
-
-    @staticmethod
-    def kind_of_time(path : str)->dict:
-        st = os.stat(path)
-        dt1, dt2, dt3 = time.localtime(st.st_mtime), time.localtime(st.st_ctime), time.localtime(st.st_atime)
-        mtime_date_s = time.strftime("%d/%m/%Y", dt1)
-        mtime_time_s = time.strftime("%H:%M", dt1)
-        ctime_date_s = time.strftime("%d/%m/%Y", dt2)
-        ctime_time_s = time.strftime("%H:%M", dt2)
-        atime_date_s = time.strftime("%d/%m/%Y", dt3)
-        atime_time_s = time.strftime("%H:%M", dt3)
-        kind_time = {'mtime': f'[{mtime_date_s}, {mtime_time_s}]', Flags.c: f'[{ctime_date_s}, {ctime_time_s}]',
-                     Flags.u: f'[{atime_date_s}, {atime_time_s}]'}
-        return kind_time
-
-    @staticmethod
-    def get_permission(path : str)->str:
-        st = os.stat(path)
-        perm = stat.filemode(st.st_mode)
-        return f'{perm}'
-
-    @staticmethod
-    def get_inode(path: str)->str:
-        st = os.stat(path)
-        return f'{st.st_ino}'
-
-    @staticmethod
-    def time_flags(args: Args) -> Optional[Union[Flags.c, Flags.u]]:
-        if Flags.c in args.flags:
-            return Flags.c
-        elif Flags.u in args.flags:
-            return Flags.u
-        return None
+    def is_hidden(entry: os.DirEntry)->bool:
+        return entry.name.startswith('.')
 
-    def get_time(self, path : str, flag: Union[Flags.c, Flags.u]=None)->str:
-        kind_time = self.kind_of_time(path)
-        return kind_time[flag] if flag else kind_time['mtime']
 
-    def provide_files(self,path:str, args: Args)->list[str]:
-        if Flags.directory in args.flags:
-            names =  self.only_folders(path)
-            if Flags.all in args.flags:
-                names.extend(self.only_hidden(path))
-        else:
-            names = self.get_vision_files(path)
-            if Flags.all in args.flags:
-                names.extend(self.only_hidden(path))
+class AttributeHidden(HiddenCheck):
+    """Windows attribute bits; scandir fills DirEntry.stat() there without another syscall."""
+
+    @staticmethod
+    def is_hidden(entry: os.DirEntry)->bool:
+        attrs = getattr(entry.stat(), 'st_file_attributes', 0)
+        return bool(attrs & FILE_ATTRIBUTE_HIDDEN)
+
+
+def hidden_check()->HiddenCheck:
+    return AttributeHidden() if os.name == 'nt' else DotfileHidden()
+
+
+def entry_stat(entry: os.DirEntry)->os.stat_result:
+    """The stat of what entry points to, or of the link itself when that dangles or loops."""
+    try:
+        return entry.stat()
+    except OSError:
+        return entry.stat(follow_symlinks=False)
+
+
+def entry_is_dir(entry: os.DirEntry, follow_symlinks: bool=True)->bool:
+    """DirEntry.is_dir, False for a link that loops instead of an OSError."""
+    try:
+        return entry.is_dir(follow_symlinks=follow_symlinks)
+    except OSError:
+        return False
+
+
+class EntryList(list):
+    """A finished listing that can stand in for the context manager os.scandir returns."""
+
+    def __enter__(self)->'EntryList':
+        return self
+
+    def __exit__(self, *exc_info)->None:
+        pass
+
+
+class DescriptorEntry:
+    """An entry of a folder listed through a descriptor, stat-ed while the descriptor was still open."""
+
+    __slots__ = ('name', 'path', 'ino', 'lstat', 'st')
+
+    def __init__(self, entry: os.DirEntry, folder: str):
+        self.name = entry.name
+        self.path = os.path.join(folder, entry.name)
+        self.ino = entry.inode()
+        self.lstat = entry.stat(follow_symlinks=False)
+        self.st = self.lstat
+        if stat.S_ISLNK(self.lstat.st_mode):
+            try:
+                self.st = entry.stat()
+            except OSError:
+                self.st = None
+
+    def is_dir(self, follow_symlinks=True)->bool:
+        st = self.st if follow_symlinks else self.lstat
+        return st is not None and stat.S_ISDIR(st.st_mode)
+
+    def is_file(self, follow_symlinks=True)->bool:
+        st = self.st if follow_symlinks else self.lstat
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def is_symlink(self)->bool:
+        return stat.S_ISLNK(self.lstat.st_mode)
+
+    def inode(self)->int:
+        return self.ino
+
+    def stat(self, follow_symlinks=True)->os.stat_result:
+        if not follow_symlinks:
+            return self.lstat
+        if self.st is None:
+            raise FileNotFoundError(f'{self.path} links to nothing')
+        return self.st
+
+
+class LocalFS:
+    """The real file system. Collection engines reach the disk only through a file system object.
+
+    The kernel refuses paths longer than PATH_MAX, which a deep enough tree has. Such a
+    folder is opened relative to the descriptor of a folder above it, a chunk of
+    levels at a time, and listed through its own descriptor. The descriptors of the
+    last folders opened that way are kept, so the next level down costs one open.
+    """
+
+    # In characters; a name of four-byte characters still fits PATH_MAX at this length.
+    long_path = 1000
+    max_anchors = 64
+    descriptors = os.scandir in os.supports_fd
+    folder_flags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.anchors = OrderedDict()
+
+    def scandir(self, path: str):
+        if len(path) < self.long_path or not self.descriptors:
+            return os.scandir(path)
+        fd = self.open_folder(path)
+        try:
+            with os.scandir(fd) as entries:
+                return EntryList(DescriptorEntry(entry, path) for entry in entries)
+        finally:
+            os.close(fd)
+
+    def stat(self, path: str)->os.stat_result:
+        if len(path) < self.long_path or not self.descriptors:
+            return os.stat(path)
+        folder, name = os.path.split(path.rstrip(os.sep))
+        fd = self.open_folder(folder)
+        try:
+            return os.stat(name, dir_fd=fd)
+        finally:
+            os.close(fd)
+
+    def open_folder(self, path: str)->int:
+        """A new descriptor of the folder at path, opened from the nearest folder above it already open."""
+        path = path.rstrip(os.sep)
+        head = path
+        names = []
+        with self.lock:
+            while head not in self.anchors and len(head) >= self.long_path:
+                head, name = os.path.split(head)
+                names.append(name)
+            fd = os.dup(self.anchors[head]) if head in self.anchors else os.open(head, self.folder_flags)
+        try:
+            while names:
+                chunk = [names.pop()]
+                size = len(chunk[0])
+                while names and size + len(names[-1]) + 1 < self.long_path:
+                    size += len(names[-1]) + 1
+                    chunk.append(names.pop())
+                child = os.open(os.path.join(*chunk), self.folder_flags, dir_fd=fd)
+                os.close(fd)
+                fd = child
+        except BaseException:
+            os.close(fd)
+            raise
+        with self.lock:
+            if path not in self.anchors:
+                self.anchors[path] = os.dup(fd)
+            self.anchors.move_to_end(path)
+            while len(self.anchors) > self.max_anchors:
+                os.close(self.anchors.popitem(last=False)[1])
+        return fd
+
+    def close(self)->None:
+        with self.lock:
+            while self.anchors:
+                os.close(self.anchors.popitem()[1])
+
+
+class LatencyEntry:
+    """DirEntry whose first stat() pays the injected latency, like a stat over the network."""
+
+    def __init__(self, entry: os.DirEntry, latency: float):
+        self.entry = entry
+        self.name = entry.name
+        self.path = entry.path
+        self.latency = latency
+        self.st = None
+
+    def is_dir(self, follow_symlinks=True)->bool:
+        return self.entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self)->bool:
+        return self.entry.is_symlink()
+
+    def inode(self)->int:
+        return self.entry.inode()
+
+    def stat(self, follow_symlinks=True)->os.stat_result:
+        if self.st is None:
+            time.sleep(self.latency)
+            self.st = self.entry.stat(follow_symlinks=follow_symlinks)
+        return self.st
+
+
+class LatencyFS:
+    """Wraps a file system and sleeps before every listing and stat, to stand in for a slow mount."""
+
+    def __init__(self, fs=None, latency: float=0.001):
+        self.fs = fs or LocalFS()
+        self.latency = latency
+
+    def scandir(self, path: str)->EntryList:
+        time.sleep(self.latency)
+        with self.fs.scandir(path) as entries:
+            return EntryList(LatencyEntry(entry, self.latency) for entry in entries)
+
+    def stat(self, path: str)->os.stat_result:
+        time.sleep(self.latency)
+        return self.fs.stat(path)
+
+
+archive_suffixes = ('.zip', '.jar', '.whl', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def split_archive_path(path: str)->Optional[tuple[str, str]]:
+    """('build.zip', 'inner/dir') when path is an archive or points inside one."""
+    head = os.path.normpath(path)
+    inner = []
+    while True:
+        if os.path.isfile(head):
+            if head.lower().endswith(archive_suffixes):
+                return head, '/'.join(reversed(inner))
+            return None
+        if os.path.exists(head):
+            return None
+        head, name = os.path.split(head)
+        if not name:
+            return None
+        inner.append(name)
+
+
+@dataclass(slots=True)
+class ArchiveStat:
+    st_mode: int
+    st_ino: int
+    st_size: int
+    st_mtime_ns: int
+    st_dev: int = 0
+    st_nlink: int = 1
+
+    @property
+    def st_mtime(self)->float:
+        return self.st_mtime_ns / 1_000_000_000
+
+    st_atime_ns = st_ctime_ns = property(lambda self: self.st_mtime_ns)
+    st_atime = st_ctime = st_mtime
+
+
+class ArchiveEntry:
+    """A member of an archive, with the DirEntry methods the collection engines use."""
+
+    def __init__(self, name: str, path: str, st: ArchiveStat):
+        self.name = name
+        self.path = path
+        self.st = st
+
+    def is_dir(self, follow_symlinks=True)->bool:
+        return stat.S_ISDIR(self.st.st_mode)
+
+    def is_file(self, follow_symlinks=True)->bool:
+        return stat.S_ISREG(self.st.st_mode)
+
+    def is_symlink(self)->bool:
+        return stat.S_ISLNK(self.st.st_mode)
+
+    def inode(self)->int:
+        return self.st.st_ino
+
+    def stat(self, follow_symlinks=True)->ArchiveStat:
+        return self.st
+
+
+class ArchiveFS:
+    """Read-only view of a zip or tar archive built from its central directory or member headers.
+
+    Nothing is extracted; member data is never read.
+    """
+
+    def __init__(self, archive: str):
+        self.archive = archive
+        self.folders = {'': {}}
+        self.inodes = itertools.count(1)
+        import tarfile
+        import zipfile
+        try:
+            if zipfile.is_zipfile(archive):
+                self.read_zip()
+            else:
+                self.read_tar()
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError):
+            raise ValueError(f'invalid archive {archive}') from None
+
+    def add(self, name: str, is_dir: bool, size: int, mtime_ns: int, mode: int)->None:
+        parts = name.strip('/').split('/')
+        if '' in parts or '.' in parts:
+            parts = [part for part in parts if part not in ('', '.')]
+        if not parts:
+            return
+        # Climb to the nearest folder already known, so a member costs its new levels only.
+        folder = '/'.join(parts[:-1])
+        missing = []
+        while folder not in self.folders:
+            folder, _, part = folder.rpartition('/')
+            missing.append(part)
+        for part in reversed(missing):
+            child = f'{folder}/{part}' if folder else part
+            self.folders[folder][part] = ArchiveStat(stat.S_IFDIR | 0o755, next(self.inodes), 0, mtime_ns)
+            self.folders[child] = {}
+            folder = child
+        self.folders[folder][parts[-1]] = ArchiveStat(mode, next(self.inodes), size, mtime_ns)
+        if is_dir:
+            self.folders.setdefault(f'{folder}/{parts[-1]}' if folder else parts[-1], {})
+
+    def read_zip(self)->None:
+        import zipfile
+        with zipfile.ZipFile(self.archive) as archive:
+            for info in archive.infolist():
+                mtime_ns = int(time.mktime(info.date_time + (0, 0, -1))) * 1_000_000_000
+                kind = stat.S_IFDIR if info.is_dir() else stat.S_IFREG
+                mode = info.external_attr >> 16 or (0o755 if info.is_dir() else 0o644)
+                if not stat.S_IFMT(mode):
+                    # zipfile.writestr and DOS tools store permission bits only.
+                    mode |= kind
+                self.add(info.filename, info.is_dir(), info.file_size, mtime_ns, mode)
+
+    def read_tar(self)->None:
+        import tarfile
+        with tarfile.open(self.archive, 'r:*') as archive:
+            for member in archive:
+                kind = stat.S_IFDIR if member.isdir() else stat.S_IFLNK if member.issym() else stat.S_IFREG
+                self.add(member.name, member.isdir(), member.size, int(member.mtime) * 1_000_000_000,
+                         kind | member.mode)
+
+    def inner_path(self, path: str)->str:
+        # A prefix match: stating every parent of a deep path would cost each level its depth.
+        head = os.path.normpath(path)
+        archive = os.path.normpath(self.archive)
+        if head == archive:
+            return ''
+        if not head.startswith(archive + os.sep):
+            raise FileNotFoundError(f'{path} is not inside {self.archive}')
+        return head[len(archive) + 1:].replace(os.sep, '/')
+
+    def contains(self, inner: str)->bool:
+        """Whether inner names a member or a folder of the archive, '' being its root."""
+        if inner in self.folders:
+            return True
+        folder, _, name = inner.rpartition('/')
+        return name in self.folders.get(folder, ())
+
+    def scandir(self, path: str)->EntryList:
+        inner = self.inner_path(path)
+        if inner not in self.folders:
+            raise NotADirectoryError(path) if self.contains(inner) else FileNotFoundError(path)
+        return EntryList(ArchiveEntry(name, os.path.join(path, name), st)
+                         for name, st in self.folders[inner].items())
+
+    def stat(self, path: str)->ArchiveStat:
+        inner = self.inner_path(path)
+        if inner == '':
+            return ArchiveStat(stat.S_IFDIR | 0o755, 0, 0, os.stat(self.archive).st_mtime_ns)
+        folder, _, name = inner.rpartition('/')
+        try:
+            return self.folders[folder][name]
+        except KeyError:
+            raise FileNotFoundError(path)
+
+
+@lru_cache(maxsize=8)
+def read_archive(archive: str, mtime_ns: int, size: int)->ArchiveFS:
+    return ArchiveFS(archive)
+
+
+def open_archive(archive: str)->ArchiveFS:
+    """The ArchiveFS of archive, read once per version of the file: checking a path and listing it share it."""
+    st = os.stat(archive)
+    return read_archive(archive, st.st_mtime_ns, st.st_size)
+
+
+def open_fs(path: str)->Union[LocalFS, ArchiveFS]:
+    archive_path = split_archive_path(path)
+    return open_archive(archive_path[0]) if archive_path else LocalFS()
+
+
+@dataclass(slots=True)
+class SnapshotStat:
+    st_mode: int
+    st_ino: int
+    st_size: int
+    st_mtime_ns: int
+    st_ctime_ns: int
+    st_atime_ns: int
+    st_file_attributes: int = 0
+    st_dev: int = 0
+    st_nlink: int = 1
+
+
+class SnapshotEntry:
+    """A record of a snapshot, with the DirEntry methods the collection engines use."""
+
+    __slots__ = ('record', 'name', 'path')
+
+    def __init__(self, record: tuple, name: str, path: str):
+        self.record = record
+        self.name = name
+        self.path = path
+
+    def is_dir(self, follow_symlinks=True)->bool:
+        return bool(self.record[5] & SnapshotFS.dir_bit)
+
+    def is_file(self, follow_symlinks=True)->bool:
+        return stat.S_ISREG(self.record[4])
+
+    def is_symlink(self)->bool:
+        return stat.S_ISLNK(self.record[4])
+
+    def inode(self)->int:
+        return self.record[7]
+
+    def stat(self, follow_symlinks=True)->SnapshotStat:
+        return SnapshotFS.record_stat(self.record)
+
+
+class SnapshotFS:
+    """A tree written by --save-snapshot, memory-mapped and listed without touching the live file system.
+
+    Layout (little-endian): a header of b'LSPS', version u8, 3 pad bytes, record
+    count u32 and string table offset u64; then one fixed-width record per entry,
+    breadth first so the children of a folder are consecutive: name offset u32,
+    name length u32, first child u32, child count u32, mode u32, bits u8 (1 dir,
+    2 hidden), 3 pad bytes, size i64, inode u64, mtime, ctime and atime ns i64,
+    device u64; then the string table of UTF-8 names. Record 0 is the root, named
+    by its path.
+    """
+
+    magic = b'LSPS'
+    version = 2
+    header_struct = struct.Struct('<4sB3xIQ')
+    record_struct = struct.Struct('<IIIIIB3xqQqqqQ')
+    dir_bit, hidden_bit = 1, 2
+
+    def __init__(self, path: str):
+        import mmap
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.strings = self.header_struct.unpack_from(self.map, 0)
+        if magic != self.magic:
+            raise ValueError(f'{path} is not a snapshot')
+        if version != self.version:
+            raise ValueError(f'{path} is a version {version} snapshot, save it again')
+        self.root = self.name(0)
+        self.directories = {os.path.normpath(self.root): 0}
+
+    def record(self, index: int)->tuple:
+        return self.record_struct.unpack_from(self.map, self.header_struct.size + index * self.record_struct.size)
+
+    def name(self, index: int)->str:
+        return self.record_name(self.record(index))
+
+    def record_name(self, record: tuple)->str:
+        start = self.strings + record[0]
+        return self.map[start:start + record[1]].decode('utf-8', 'surrogateescape')
+
+    @staticmethod
+    def record_stat(record: tuple)->SnapshotStat:
+        _offset, _length, _first, _count, mode, bits, size, inode, mtime_ns, ctime_ns, atime_ns, dev = record
+        return SnapshotStat(mode, inode, size, mtime_ns, ctime_ns, atime_ns,
+                            FILE_ATTRIBUTE_HIDDEN if bits & SnapshotFS.hidden_bit else 0, dev)
+
+    def index_of(self, path: str)->int:
+        key = os.path.normpath(path)
+        names = []
+        index = self.directories.get(key)
+        while index is None:
+            parent = os.path.dirname(key) or os.curdir
+            if parent == key:
+                raise FileNotFoundError(f'{path} is not in the snapshot of {self.root}')
+            names.append(os.path.basename(key))
+            key = parent
+            index = self.directories.get(key)
+        for name in reversed(names):
+            _offset, _length, first, count, *_rest = self.record(index)
+            index = next((child for child in range(first, first + count) if self.name(child) == name), None)
+            if index is None:
+                raise FileNotFoundError(f'{path} is not in the snapshot of {self.root}')
+        return index
+
+    def scandir(self, path: str)->EntryList:
+        _offset, _length, first, count, _mode, bits, *_rest = self.record(self.index_of(path))
+        if not bits & self.dir_bit:
+            raise NotADirectoryError(path)
+        entries = EntryList()
+        offset = self.header_struct.size + first * self.record_struct.size
+        for child, record in enumerate(self.record_struct.iter_unpack(
+                self.map[offset:offset + count * self.record_struct.size]), start=first):
+            name = self.record_name(record)
+            entry = SnapshotEntry(record, name, os.path.join(path, name))
+            if record[5] & self.dir_bit:
+                self.directories[os.path.normpath(entry.path)] = child
+            entries.append(entry)
+        return entries
+
+    def stat(self, path: str)->SnapshotStat:
+        return self.record_stat(self.record(self.index_of(path)))
+
+    def resolve(self, path: str)->str:
+        """A relative path names an entry under the snapshot root, unless it already starts with the root."""
+        root = os.path.normpath(self.root)
+        key = os.path.normpath(path)
+        if os.path.isabs(key) or root == os.curdir or key == root or key.startswith(root + os.sep):
+            return path
+        return os.path.join(self.root, path)
+
+    def close(self)->None:
+        self.map.close()
+
+
+class SnapshotWriter:
+    """Saves a recursive walk as a SnapshotFS file, writing records as they are read.
+
+    The walk is breadth first, so only the folders waiting to be read are held in
+    memory; names go to a temporary file and are appended as the string table.
+    The target is replaced only once the whole walk succeeded.
+    """
+
+    def __init__(self, info: 'ScanInfoProvide'):
+        self.info = info
+
+    def entry_record(self, entry: os.DirEntry, args: Args, depth: int)->tuple:
+        follow_symlinks = args.plan.has(Flags.follow_symlinks)
+        st = entry_stat(entry) if follow_symlinks else entry.stat(follow_symlinks=False)
+        bits = SnapshotFS.dir_bit if entry_is_dir(entry, follow_symlinks) else 0
+        if self.info.hidden.is_hidden(entry):
+            bits |= SnapshotFS.hidden_bit
+        return entry.name, entry.path, st, entry.inode(), bits, depth
+
+    def listed_entries(self, path: str, args: Args, walk: Walk)->list[os.DirEntry]:
+        """The entries of path to record, without the hard links walk already recorded under --dedup."""
+        entries = self.info.provide_files(path, args)
+        if not args.plan.has(Flags.dedup):
+            return entries
+        follow_symlinks = args.plan.has(Flags.follow_symlinks)
+        return [entry for entry in entries
+                if (key := self.info.link_key(entry, follow_symlinks)) is None or walk.first_visit(key)]
+
+    def save(self, args: Args, target: str)->int:
+        """Writes every entry under args.path, hidden ones included, and returns the record count."""
+        args = dc_replace(args, flags=[*args.flags, Flags.all])
+        partial = f'{target}.partial'
+        try:
+            written = self.write(args, self.info.fs.stat(args.path), partial)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        os.replace(partial, target)
+        return written
+
+    def write(self, args: Args, st: os.stat_result, target: str)->int:
+        import shutil
+        import tempfile
+        header, record = SnapshotFS.header_struct, SnapshotFS.record_struct
+        waiting = deque([(args.path, args.path, st, st.st_ino, SnapshotFS.dir_bit, 0)])
+        walk = Walk(st)
+        count = 1
+        written = 0
+        strings_size = 0
+        with open(target, 'wb') as out, tempfile.TemporaryFile() as strings:
+            out.write(bytes(header.size))
+            while waiting:
+                name, path, st, inode, bits, depth = waiting.popleft()
+                first_child = child_count = 0
+                if bits & SnapshotFS.dir_bit and (args.max_depth is None or depth <= args.max_depth) \
+                        and (depth == 0 or self.info.enter(args, walk, Walk.key(st))):
+                    entries = self.listed_entries(path, args, walk)
+                    self.info.stats.add(dir_reads=1, stat_calls=len(entries))
+                    first_child, child_count = count, len(entries)
+                    count += child_count
+                    waiting.extend(self.entry_record(entry, args, depth + 1) for entry in entries)
+                encoded = name.encode('utf-8', 'surrogateescape')
+                out.write(record.pack(strings_size, len(encoded), first_child, child_count, st.st_mode, bits,
+                                      st.st_size, inode, st.st_mtime_ns, st.st_ctime_ns, st.st_atime_ns,
+                                      st.st_dev))
+                strings.write(encoded)
+                strings_size += len(encoded)
+                written += 1
+            strings.seek(0)
+            strings_offset = out.tell()
+            shutil.copyfileobj(strings, out)
+            out.seek(0)
+            out.write(header.pack(SnapshotFS.magic, SnapshotFS.version, written, strings_offset))
+        return written
+
+
+class ListingCache:
+    """Persistent per-directory listings in SQLite.
+
+    A directory is served from the cache while its device, inode and mtime are
+    unchanged and it is listed with the same flags. Only the directory's own mtime
+    is checked, so edits to a file that leave the directory untouched are not seen.
+
+    Listings may share the file: it is in WAL mode, every put commits at once and
+    a get only reads. A cache another listing keeps busy past busy_timeout is
+    dropped for the rest of the listing, which then only misses, never fails.
+    """
+
+    max_bytes = 64 << 20
+    racy_ns = 2_000_000_000
+    busy_timeout = 1.0
+    key_flags = (Flags.all, Flags.directory, Flags.size, Flags.time, Flags.permission, Flags.inode, Flags.u, Flags.c,
+                 Flags.prune_hidden_dirs, Flags.follow_symlinks, Flags.color, Flags.recursive)
+
+    def __init__(self, path: str, max_bytes: Optional[int]=None):
+        self.max_bytes = max_bytes or self.max_bytes
+        import sqlite3
+        self.sqlite3 = sqlite3
+        self.lock = threading.Lock()
+        # Gets only note what they used; the next commit writes it down.
+        self.used = []
+        self.total = 0
+        self.connection = sqlite3.connect(path, timeout=self.busy_timeout, check_same_thread=False)
+        try:
+            with self.connection:
+                self.connection.execute('PRAGMA journal_mode=WAL')
+                self.connection.execute('PRAGMA synchronous=NORMAL')
+                self.connection.execute('CREATE TABLE IF NOT EXISTS listing (path TEXT, flags TEXT, stamp TEXT, '
+                                        'data TEXT, size INTEGER, used INTEGER, PRIMARY KEY (path, flags))')
+                self.total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM listing').fetchone()[0]
+        except sqlite3.OperationalError:
+            self.drop()
+
+    def flags_key(self, args: Args)->str:
+        key = ','.join(flag.name for flag in self.key_flags if flag in args.flags)
+        if args.plan.palette is not None and args.plan.palette.modes:
+            # Records then hold the whole st_mode in kind, not only the type bits.
+            key += ',modes'
+        if args.exclude:
+            key += '\0' + '\0'.join(args.exclude)
+        return key
+
+    @staticmethod
+    def stamp(st: os.stat_result)->str:
+        return f'{st.st_dev}:{st.st_ino}:{st.st_mtime_ns}'
+
+    @staticmethod
+    def to_items(path: str, data: str)->list[Union[File, Folder]]:
+        return ListingCache.rows_to_items(path, json.loads(data))
+
+    @staticmethod
+    def from_items(items: list[Union[File, Folder]])->str:
+        return json.dumps(ListingCache.item_rows(items))
+
+    @staticmethod
+    def rows_to_items(path: str, rows: Iterable[tuple])->list[Union[File, Folder]]:
+        items = []
+        # Rows written before kind and visit were stored have six or seven fields.
+        for is_dir, filename, inode, size, _time, mode, *rest in rows:
+            _file = File(inode=inode, full_path=os.path.join(path, filename), filename=filename,
+                         size=size, time=_time, mode=mode, kind=rest[0] if rest else None)
+            visit = tuple(rest[1]) if len(rest) > 1 and rest[1] else None
+            items.append(Folder(folder_details=_file, files_details=None, visit=visit) if is_dir else _file)
+        return items
+
+    @staticmethod
+    def item_rows(items: list[Union[File, Folder]])->list[tuple]:
+        rows = []
+        for item in items:
+            is_dir = isinstance(item, Folder)
+            f = item.folder_details if is_dir else item
+            rows.append((is_dir, f.filename, f.inode, f.size, f.time, f.mode, f.kind, item.visit if is_dir else None))
+        return rows
+
+    def get(self, path: str, st: os.stat_result, args: Args)->Optional[list[Union[File, Folder]]]:
+        with self.lock:
+            if self.connection is None:
+                return None
+            try:
+                row = self.connection.execute('SELECT stamp, data FROM listing WHERE path = ? AND flags = ?',
+                                              (path, self.flags_key(args))).fetchone()
+            except self.sqlite3.OperationalError:
+                self.drop()
+                return None
+            if row is None or row[0] != self.stamp(st):
+                return None
+            self.used.append((time.time_ns(), path, self.flags_key(args)))
+        return self.to_items(path, row[1])
+
+    def put(self, path: str, st: os.stat_result, args: Args, items: list[Union[File, Folder]])->None:
+        if time.time_ns() - st.st_mtime_ns < self.racy_ns:
+            return
+        data = self.from_items(items)
+        with self.lock:
+            if self.connection is None:
+                return
+            try:
+                with self.connection:
+                    old = self.connection.execute('SELECT size FROM listing WHERE path = ? AND flags = ?',
+                                                  (path, self.flags_key(args))).fetchone()
+                    self.connection.execute('INSERT OR REPLACE INTO listing VALUES (?, ?, ?, ?, ?, ?)',
+                                            (path, self.flags_key(args), self.stamp(st), data, len(data),
+                                             time.time_ns()))
+                    self.write_used()
+                    total = self.total + len(data) - (old[0] if old else 0)
+                    if total > self.max_bytes:
+                        total = self.evict(total)
+                self.total = total
+            except self.sqlite3.OperationalError:
+                self.drop()
+
+    def drop(self)->None:
+        self.connection.close()
+        self.connection = None
+
+    def write_used(self)->None:
+        self.connection.executemany('UPDATE listing SET used = ? WHERE path = ? AND flags = ?', self.used)
+        self.used.clear()
+
+    def evict(self, total: int)->int:
+        rows = self.connection.execute('SELECT path, flags, size FROM listing ORDER BY used').fetchall()
+        for path, flags, size in rows:
+            if total <= self.max_bytes * 3 // 4:
+                break
+            self.connection.execute('DELETE FROM listing WHERE path = ? AND flags = ?', (path, flags))
+            total -= size
+        return total
+
+    def close(self)->None:
+        with self.lock:
+            if self.connection is None:
+                return
+            try:
+                with self.connection:
+                    self.write_used()
+            except self.sqlite3.OperationalError:
+                pass
+            self.drop()
+
+
+class SharedListingCache(ListingCache):
+    """ListingCache held in memory by a --serve daemon and shared by all of its requests.
+
+    Listings are validated by the folder's stamp like the SQLite cache. Since a file
+    rewritten in place leaves that stamp alone, the daemon uses it only for listings
+    that show no size, time or mode. Records of files are shared as they are, since
+    nothing changes them once collected; folders get fresh records and wrappers on
+    every get, since a listing fills in their contents and totals.
+    """
+
+    max_entries = 1 << 16
+
+    def __init__(self, max_entries: Optional[int]=None):
+        self.max_entries = max_entries or self.max_entries
+        self.lock = threading.Lock()
+        self.listings = OrderedDict()
+
+    @staticmethod
+    def detached(items: list[Union[File, Folder]])->list[Union[File, Folder]]:
+        return [Folder(folder_details=File(f.inode, f.full_path, f.filename, f.size, f.time, f.mode, kind=f.kind),
+                       files_details=None, visit=item.visit) if isinstance(item, Folder) and (f := item.folder_details)
+                else item for item in items]
+
+    def get(self, path: str, st: os.stat_result, args: Args)->Optional[list[Union[File, Folder]]]:
+        key = (path, self.flags_key(args))
+        with self.lock:
+            hit = self.listings.get(key)
+            if hit is None or hit[0] != self.stamp(st):
+                return None
+            self.listings.move_to_end(key)
+        return self.detached(hit[1])
+
+    def put(self, path: str, st: os.stat_result, args: Args, items: list[Union[File, Folder]])->None:
+        if time.time_ns() - st.st_mtime_ns < self.racy_ns:
+            return
+        key = (path, self.flags_key(args))
+        items = self.detached(items)
+        with self.lock:
+            self.listings[key] = (self.stamp(st), items)
+            self.listings.move_to_end(key)
+            while len(self.listings) > self.max_entries:
+                self.listings.popitem(last=False)
+
+    def close(self)->None:
+        """Kept for the next request: the daemon owns it, not the listing."""
+
+
+class ScanInfoProvide:
+    """Collection engine on top of os.scandir.
+
+    Every directory is listed once and every entry is stat-ed at most once
+    (DirEntry caches the result), so a listing costs O(entries) syscalls.
+    """
+
+    def __init__(self, hidden: Optional[HiddenCheck]=None, cache: Optional[ListingCache]=None,
+                 stats: Optional[Stats]=None, fs=None):
+        self.hidden = hidden or hidden_check()
+        self.cache = cache
+        self.stats = stats or Stats()
+        self.fs = fs or LocalFS()
+        self.memo = {}
+        self.memo_roots = ()
+
+    def memo_get(self, path: str)->Optional[list[Union[File, Folder]]]:
+        items = self.memo.get(os.path.normpath(path)) if self.memo else None
+        return None if items is None else SharedListingCache.detached(items)
+
+    def memo_put(self, path: str, items: list[Union[File, Folder]])->None:
+        """Keeps a listing only if a root still to be walked in this call contains it.
+
+        Like the daemon's cache, the memo holds and hands out detached folders, so
+        what one root's walk fills in never shows up under another root.
+        """
+        key = os.path.normpath(path)
+        for root in self.memo_roots:
+            if key == root or key.startswith(root.rstrip(os.sep) + os.sep):
+                self.memo[key] = SharedListingCache.detached(items)
+                return
+
+    def provide_files(self, path: str, args: Args)->list[os.DirEntry]:
+        names = []
+        hidden = []
+        only_directories = args.plan.has(Flags.directory)
+        prune_hidden_dirs = args.plan.has(Flags.prune_hidden_dirs)
+        excluded = args.excluded
+        is_hidden = self.hidden.is_hidden
+        with self.fs.scandir(path) as entries:
+            for entry in entries:
+                if excluded is not None and excluded(entry.name):
+                    continue
+                if prune_hidden_dirs and entry_is_dir(entry) and is_hidden(entry):
+                    continue
+                if only_directories and entry_is_dir(entry):
+                    names.append(entry)
+                elif is_hidden(entry):
+                    hidden.append(entry)
+                elif not only_directories:
+                    names.append(entry)
+        if args.plan.has(Flags.all):
+            names.extend(hidden)
         return names
 
-    def info_to_folder(self, args: Args, names: list)->list[Union[File, Folder]]:
-        final_names = []
-        for name in names:
-            full_path = os.path.join(args.path, name)
-            _file = File(inode=None, full_path=full_path, filename=name, size=None, time=None, permission=None)
-            if Flags.size in args.flags:
-                _file.size = self.get_size(full_path)
-            if Flags.time in args.flags:
-                _file.time = self.get_time(full_path, self.time_flags(args))
-            if Flags.permission in args.flags:
-                _file.permission = self.get_permission(full_path)
-            if Flags.inode in args.flags:
-                _file.inode = self.get_inode(full_path)
-            if os.path.isdir(full_path):
-                if Flags.recursive in args.flags:
-                    child_args = dc_replace(args, path=full_path, flags=args.flags)
-                    _folder = Folder(folder_details=_file,
-                                 files_details=self.info_to_folder(child_args, self.provide_files(full_path, args)))
-                else:
-                    _folder = Folder(folder_details=_file,files_details=None)
-                final_names.append(_folder)
-            if not os.path.isdir(full_path):
-                final_names.append(_file)
+    def entry_to_item(self, entry: os.DirEntry, args: Args)->Union[File, Folder]:
+        _file = args.plan.make_file(entry)
+        follow_symlinks = args.plan.has(Flags.follow_symlinks)
+        if entry_is_dir(entry, follow_symlinks):
+            # Taken here, in the scan, from the stat the entry caches: the walk decides on it without any I/O.
+            visit = Walk.key(entry.stat(follow_symlinks=follow_symlinks)) if args.plan.has(Flags.recursive) else None
+            return Folder(folder_details=_file, files_details=None, visit=visit)
+        if args.plan.has(Flags.dedup):
+            _file.link = self.link_key(entry, follow_symlinks)
+        return _file
+
+    @staticmethod
+    def link_key(entry: os.DirEntry, follow_symlinks: bool)->Optional[tuple[int, int]]:
+        """(st_dev, st_ino) of a file entry with other hard links, the key --dedup lists it once by."""
+        st = entry_stat(entry) if follow_symlinks else entry.stat(follow_symlinks=False)
+        if st.st_nlink < 2 or stat.S_ISDIR(st.st_mode):
+            return None
+        return Walk.key(st)
+
+    def read_folder(self, path: str, args: Args)->list[Union[File, Folder]]:
+        entries = self.provide_files(path, args)
+        items = [self.entry_to_item(entry, args) for entry in entries]
+        self.stats.add(dir_reads=1, stat_calls=self.item_stats(args, items))
+        return items
+
+    @staticmethod
+    def item_stats(args: Args, items: list[Union[File, Folder]])->int:
+        """Stats collecting items cost: one per entry for the plan, else one per folder of a recursive walk
+        and, under --dedup, one per file for its link count."""
+        if args.plan.needs_stat:
+            return len(items)
+        folders = sum(isinstance(item, Folder) for item in items)
+        calls = folders if args.plan.has(Flags.recursive) else 0
+        if args.plan.has(Flags.dedup):
+            calls += len(items) - folders
+        return calls
+
+    def scan_folder(self, path: str, args: Args)->list[Union[File, Folder]]:
+        """The listing of path as collected, before the walk has a say; safe to run on any thread."""
+        final_names = self.memo_get(path)
+        if final_names is not None:
+            return final_names
+        if self.cache is None:
+            final_names = self.read_folder(path, args)
+        else:
+            st = self.fs.stat(path)
+            self.stats.add(stat_calls=1)
+            final_names = self.cache.get(path, st, args)
+            if final_names is None:
+                final_names = self.read_folder(path, args)
+                self.cache.put(path, st, args, final_names)
+        self.memo_put(path, final_names)
         return final_names
 
-    def info_for_print(self, args: Args, names: list)->Folder:
-        folder = Folder(files_details = self.info_to_folder(args, names), folder_details=None)
-        return folder
+    @staticmethod
+    def folder_total(folder_details: Optional[File], files_details: list[Union[File, Folder]])->int:
+        """Size of a folder's subtree from the totals its sub folders already hold."""
+        total = folder_details.size or 0 if folder_details else 0
+        for item in files_details:
+            _file = item.folder_details if isinstance(item, Folder) else item
+            total += _file.total if _file.total is not None else _file.size or 0
+        return total
+
+    def new_walk(self, args: Args)->Walk:
+        """The Walk of one listing of args.path; a recursive one holds the root, so no link leads back into it."""
+        if not args.plan.has(Flags.recursive):
+            return Walk()
+        self.stats.add(stat_calls=1)
+        return Walk(self.fs.stat(args.path))
+
+    @staticmethod
+    def enter(args: Args, walk: Walk, visit: tuple[int, int])->bool:
+        """Whether walk may descend into the folder visit names: not entered yet, and on the root's device under
+        --one-file-system."""
+        if args.plan.has(Flags.one_file_system) and visit[0] != walk.device:
+            return False
+        return walk.first_visit(visit)
+
+    def sub_folders(self, args: Args, walk: Walk, items: list[Union[File, Folder]], depth: int)->Iterator[Folder]:
+        """Folders of the listing at depth to descend into, none once --max-depth is reached."""
+        if not args.plan.has(Flags.recursive) or args.max_depth is not None and depth >= args.max_depth:
+            return
+        for item in items:
+            if isinstance(item, Folder) and self.enter(args, walk, item.visit):
+                yield item
+
+    @staticmethod
+    def dedup(args: Args, walk: Walk, items: list[Union[File, Folder]])->list[Union[File, Folder]]:
+        """items without the hard links walk already listed, under --dedup."""
+        if not args.plan.has(Flags.dedup):
+            return items
+        return [item for item in items if isinstance(item, Folder) or item.link is None or walk.first_visit(item.link)]
+
+    def visit(self, args: Args, walk: Walk, items: list[Union[File, Folder]],
+              depth: int)->tuple[list[Union[File, Folder]], list[Folder]]:
+        """What walk keeps of a scanned listing at depth, and the sub folders to descend into.
+
+        Every engine calls this on the printing side, one listing at a time in print
+        order, never where the scans run, so which folder and which hard link the walk
+        takes first is the same whatever order the scans finish in.
+        """
+        items = self.dedup(args, walk, items)
+        return items, list(self.sub_folders(args, walk, items, depth))
+
+    def fill_folders(self, args: Args, walk: Walk, items: list[Union[File, Folder]],
+                     depth=0)->list[Union[File, Folder]]:
+        """Scan every folder under items depth first, on an explicit stack so any depth fits."""
+        items, sub_folders = self.visit(args, walk, items, depth)
+        stack = [iter(sub_folders)]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+                continue
+            item.files_details, sub_folders = self.visit(
+                args, walk, self.scan_folder(item.folder_details.full_path, args), depth + len(stack))
+            stack.append(iter(sub_folders))
+        return items
+
+    def tree_batches(self, args: Args, folder_details: Optional[File], files_details: list[Union[File, Folder]],
+                     depth=0)->Iterator[Batch]:
+        """Batches of an already collected tree, in the order iter_batches yields them."""
+        stack = [(folder_details, files_details, iter(files_details))]
+        while stack:
+            folder_details, files_details, pending = stack[-1]
+            for item in pending:
+                if isinstance(item, Folder) and item.files_details is not None:
+                    stack.append((item.folder_details, item.files_details, iter(item.files_details)))
+                    break
+            else:
+                stack.pop()
+                yield self.make_batch(args, folder_details, files_details, depth + len(stack))
+
+    def make_batch(self, args: Args, folder_details: Optional[File], files_details: list[Union[File, Folder]],
+                   depth: int)->Batch:
+        batch = Batch(folder_details=folder_details, files_details=files_details, depth=depth)
+        if args.plan.has(Flags.total):
+            batch.total = self.folder_total(folder_details, files_details)
+            if folder_details is not None:
+                folder_details.total = batch.total
+        return batch
+
+    def iter_batches(self, path: str, args: Args, folder_details: Optional[File]=None,
+                     depth=0)->Iterator[Batch]:
+        """Yield one Batch per directory, sub folders first, in the order they are printed.
+
+        Only the listings along the current path are held in memory, never the whole tree.
+        """
+        walk = self.new_walk(args)
+        files_details, sub_folders = self.visit(args, walk, self.scan_folder(path, args), depth)
+        stack = [(folder_details, files_details, iter(sub_folders))]
+        while stack:
+            folder_details, files_details, pending = stack[-1]
+            item = next(pending, None)
+            if item is None:
+                stack.pop()
+                yield self.make_batch(args, folder_details, files_details, depth + len(stack))
+                continue
+            level = depth + len(stack)
+            files_details, sub_folders = self.visit(args, walk, self.scan_folder(item.folder_details.full_path, args),
+                                                    level)
+            stack.append((item.folder_details, files_details, iter(sub_folders)))
+
+
+class ScanWindow:
+    """The directory scans of one --jobs walk, run on a pool at most `size` ahead of the printer.
+
+    Taking a listing visits it, which queues the sub folders it enters, first one
+    on top, so idle workers take the directories the printer reaches next; the
+    one it waits for is started even when the window is full. Only scans running
+    or finished and not yet taken count, so memory stays bounded by a few
+    directory listings.
+    """
+
+    def __init__(self, info: 'ParallelScanInfoProvide', pool: 'ThreadPoolExecutor', args: Args, walk: Walk,
+                 size: int):
+        self.info = info
+        self.pool = pool
+        self.args = args
+        self.walk = walk
+        self.size = size
+        self.stack = []
+        self.queued = set()
+        self.running = {}
+        self.scanned = {}
+
+    def add(self, path: str)->None:
+        self.stack.append(path)
+        self.queued.add(path)
+
+    def submit(self, path: str)->None:
+        self.queued.remove(path)
+        self.running[self.pool.submit(self.info.scan_folder, path, self.args)] = path
+
+    def start(self, needed: Optional[str]=None)->None:
+        if needed in self.queued:
+            self.submit(needed)
+        while self.stack and len(self.running) + len(self.scanned) < self.size:
+            path = self.stack.pop()
+            if path in self.queued:
+                self.submit(path)
+
+    def finish(self, future: 'Future')->None:
+        self.scanned[self.running.pop(future)] = future.result()
+
+    def take(self, path: str, depth: int)->tuple[list[Union[File, Folder]], list[Folder]]:
+        """The listing of path, visited once its scan is done, and the sub folders to descend into."""
+        from concurrent.futures import FIRST_COMPLETED, wait
+        while True:
+            for future in [future for future in self.running if future.done()]:
+                self.finish(future)
+            if path in self.scanned:
+                break
+            self.start(path)
+            wait(self.running, return_when=FIRST_COMPLETED)
+        files_details, sub_folders = self.info.visit(self.args, self.walk, self.scanned.pop(path), depth)
+        for item in reversed(sub_folders):
+            self.add(item.folder_details.full_path)
+        self.start()
+        return files_details, sub_folders
+
+
+class ParallelScanInfoProvide(ScanInfoProvide):
+    """Scans sub folders concurrently on a thread pool.
+
+    A ScanWindow keeps up to `window` directories (four per worker by default)
+    scanning or scanned ahead of the printer. Batches are still yielded in the
+    serial order.
+    """
+
+    def __init__(self, jobs: int, hidden: Optional[HiddenCheck]=None, cache: Optional[ListingCache]=None,
+                 stats: Optional[Stats]=None, fs=None, window: Optional[int]=None):
+        super().__init__(hidden, cache, stats, fs)
+        self.jobs = jobs
+        self.window = window or 4 * jobs
+
+    def iter_scanned(self, args: Args, window: ScanWindow, path: str, folder_details: Optional[File],
+                     depth: int)->Iterator[Batch]:
+        window.add(path)
+        files_details, sub_folders = window.take(path, depth)
+        stack = [(folder_details, files_details, iter(sub_folders))]
+        while stack:
+            folder_details, files_details, pending = stack[-1]
+            item = next(pending, None)
+            if item is None:
+                stack.pop()
+                yield self.make_batch(args, folder_details, files_details, depth + len(stack))
+                continue
+            files_details, sub_folders = window.take(item.folder_details.full_path, depth + len(stack))
+            stack.append((item.folder_details, files_details, iter(sub_folders)))
+
+    def iter_batches(self, path: str, args: Args, folder_details: Optional[File]=None,
+                     depth=0)->Iterator[Batch]:
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=self.jobs)
+        try:
+            window = ScanWindow(self, pool, args, self.new_walk(args), self.window)
+            yield from self.iter_scanned(args, window, path, folder_details, depth)
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+
+class AsyncInfoProvide(ScanInfoProvide):
+    """Collects with asyncio: every listing and stat runs on an executor, at most `limit` at a time.
+
+    On a high-latency mount the waits overlap instead of adding up. Scans start as
+    soon as their parent is visited, while the listings are visited in print
+    order, so the Folder tree and the output are identical to the serial engine's.
+    """
+
+    default_limit = 32
+
+    def __init__(self, limit: int=default_limit, hidden: Optional[HiddenCheck]=None,
+                 cache: Optional[ListingCache]=None, stats: Optional[Stats]=None, fs=None):
+        super().__init__(hidden, cache, stats, fs)
+        self.limit = limit
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        self.asyncio = asyncio
+        self.executor_class = ThreadPoolExecutor
+
+    async def run(self, semaphore: 'asyncio.Semaphore', executor: 'ThreadPoolExecutor', function, *args):
+        async with semaphore:
+            return await self.asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+    async def scan_folder_async(self, run, path: str, args: Args)->list[Union[File, Folder]]:
+        if self.cache is not None or self.memo_get(path) is not None:
+            return await run(self.scan_folder, path, args)
+        entries = await run(self.provide_files, path, args)
+        items = list(await self.asyncio.gather(*(run(self.entry_to_item, entry, args) for entry in entries)))
+        self.stats.add(dir_reads=1, stat_calls=self.item_stats(args, items))
+        self.memo_put(path, items)
+        return items
+
+    def scan_tasks(self, run, args: Args, folders: list[Folder])->Iterator[tuple[Folder, 'asyncio.Task']]:
+        """Starts the scans of folders at once; they are visited later, one by one."""
+        return iter([(folder, self.asyncio.ensure_future(
+                         self.scan_folder_async(run, folder.folder_details.full_path, args))) for folder in folders])
+
+    async def fill_folders_async(self, run, args: Args, walk: Walk, items: list[Union[File, Folder]],
+                                 depth=0)->list[Union[File, Folder]]:
+        items, sub_folders = self.visit(args, walk, items, depth)
+        stack = [self.scan_tasks(run, args, sub_folders)]
+        while stack:
+            pending = next(stack[-1], None)
+            if pending is None:
+                stack.pop()
+                continue
+            folder, scan = pending
+            folder.files_details, sub_folders = self.visit(args, walk, await scan, depth + len(stack))
+            stack.append(self.scan_tasks(run, args, sub_folders))
+        return items
+
+    async def collect(self, path: str, args: Args)->list[Union[File, Folder]]:
+        semaphore = self.asyncio.Semaphore(self.limit)
+        with self.executor_class(max_workers=self.limit) as executor:
+            run = functools.partial(self.run, semaphore, executor)
+            walk = await run(self.new_walk, args)
+            items = await self.scan_folder_async(run, path, args)
+            return await self.fill_folders_async(run, args, walk, items)
+
+    def iter_batches(self, path: str, args: Args, folder_details: Optional[File]=None,
+                     depth=0)->Iterator[Batch]:
+        # make_batch sums the totals, bottom up, as tree_batches yields them.
+        yield from self.tree_batches(args, folder_details, self.asyncio.run(self.collect(path, args)), depth)
+
+
+class OutputWriter:
+    """Collects output into large chunks and writes them straight to the binary stdout.
+
+    A binary writer takes bytes and writes them untouched.
+    """
+
+    chunk_size = 1 << 16
+
+    def __init__(self, stream=None, binary=False):
+        self.stream = stream or sys.stdout
+        self.buffer = getattr(self.stream, 'buffer', None)
+        self.binary = binary
+        self.interactive = self.stream.isatty()
+        self.parts = []
+        self.pending = 0
+        self.bytes_written = 0
+
+    def write(self, text: str)->None:
+        self.parts.append(text)
+        self.pending += len(text)
+        if self.pending >= self.chunk_size:
+            self.flush()
+
+    def flush(self)->None:
+        if self.binary:
+            data = b''.join(self.parts)
+            self.parts.clear()
+            self.pending = 0
+            self.bytes_written += len(data)
+            target = self.stream if self.buffer is None else self.buffer
+            target.write(data)
+            target.flush()
+            return
+        data = ''.join(self.parts)
+        self.parts.clear()
+        self.pending = 0
+        if self.buffer is None:
+            self.bytes_written += len(data)
+            self.stream.write(data)
+            self.stream.flush()
+            return
+        if os.linesep != '\n':
+            data = data.replace('\n', os.linesep)
+        encoded = data.encode(self.stream.encoding, self.stream.errors)
+        self.bytes_written += len(encoded)
+        self.stream.flush()
+        self.buffer.write(encoded)
+        self.buffer.flush()
+
+
+class Sorter:
+    """Orders one directory's records by --sort keys (or -S), computing every key once per entry.
+
+    With --head N only the first N are kept, through a heap instead of a full sort.
+    """
+
+    def __init__(self, keys: list[str], reverse=False, head: Optional[int]=None):
+        self.key_functions = [sort_keys[key] for key in keys]
+        self.reverse = reverse
+        self.head = head
+
+    @staticmethod
+    def from_args(args: Args)->Optional['Sorter']:
+        keys = args.sort or (['size'] if args.plan.has(Flags.S) else [])
+        if not keys and not args.plan.has(Flags.reverse) and args.head is None:
+            return None
+        return Sorter(keys, args.plan.has(Flags.reverse), args.head)
+
+    def key(self):
+        if len(self.key_functions) == 1:
+            return self.key_functions[0]
+        key_functions = self.key_functions
+        return lambda f: tuple(key_function(f) for key_function in key_functions)
+
+    def sort(self, files: list[File])->list[File]:
+        if not self.key_functions:
+            files = files[::-1] if self.reverse else files
+            return files if self.head is None else files[:self.head]
+        if self.head is not None:
+            select = heapq.nlargest if self.reverse else heapq.nsmallest
+            return select(self.head, files, key=self.key())
+        return sorted(files, key=self.key(), reverse=self.reverse)
+
+
+class LsColors:
+    """LS_COLORS compiled once into lookup tables, so painting an entry costs dict lookups and no syscall.
+
+    Entries are told apart by the type collection already recorded in File.kind:
+    a DirEntry knows links, folders and regular files without a stat. Permission
+    bits are read during collection only when a mode key (ex, su, sg, st, tw, ow)
+    is set. Suffix patterns (*.tar.gz) color regular files without a mode color.
+    """
+
+    # Used when LS_COLORS is unset: blue folders, bright white everything else.
+    default = 'di=34:fi=97'
+    type_keys = {stat.S_IFDIR: 'di', stat.S_IFLNK: 'ln', stat.S_IFIFO: 'pi', stat.S_IFSOCK: 'so',
+                 stat.S_IFBLK: 'bd', stat.S_IFCHR: 'cd', stat.S_IFREG: 'fi'}
+    mode_keys = ('su', 'sg', 'ex', 'tw', 'ow', 'st')
+
+    def __init__(self, spec: str):
+        codes = {}
+        suffixes = {}
+        for item in spec.split(':'):
+            key, sep, code = item.partition('=')
+            if not sep or not code:
+                continue
+            if key.startswith('*'):
+                suffixes[key[1:].lower()] = self.sgr(code)
+            else:
+                codes[key] = code
+        self.reset = self.sgr(codes.get('rs', '0'))
+        self.file_color = self.sgr(codes.get('fi') or codes.get('no', ''))
+        # ln=target asks for the color of the link's target, which would need a stat: links keep the file color.
+        self.types = {file_type: self.sgr(codes[key]) if key in codes and codes[key] != 'target' else self.file_color
+                      for file_type, key in self.type_keys.items()}
+        self.modes = {key: self.sgr(codes[key]) for key in self.mode_keys if key in codes}
+        self.suffixes = suffixes
+        self.suffix_lengths = sorted({len(suffix) for suffix in suffixes}, reverse=True)
+
+    @staticmethod
+    def sgr(code: str)->str:
+        return f'\x1b[{code}m' if code else ''
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def from_spec(spec: Optional[str])->'LsColors':
+        """The palette of an LS_COLORS value, compiled once per value; the default one when unset."""
+        return LsColors(spec or LsColors.default)
+
+    @staticmethod
+    def entry_type(entry: os.DirEntry)->int:
+        """File type bits of entry; a real DirEntry answers for links, folders and regular files from the listing."""
+        if entry.is_symlink():
+            return stat.S_IFLNK
+        if entry.is_dir(follow_symlinks=False):
+            return stat.S_IFDIR
+        if entry.is_file(follow_symlinks=False):
+            return stat.S_IFREG
+        return stat.S_IFMT(entry.stat(follow_symlinks=False).st_mode)
+
+    def kind_fetcher(self)->Callable[[os.DirEntry], int]:
+        if self.modes:
+            return lambda entry: entry.stat(follow_symlinks=False).st_mode
+        return self.entry_type
+
+    def color(self, kind: int, name: str)->str:
+        """The escape sequence starting an entry of st_mode (or type bits) kind, empty for none."""
+        file_type = stat.S_IFMT(kind)
+        modes = self.modes
+        if file_type == stat.S_IFREG:
+            if modes:
+                if kind & stat.S_ISUID and 'su' in modes:
+                    return modes['su']
+                if kind & stat.S_ISGID and 'sg' in modes:
+                    return modes['sg']
+                if kind & 0o111 and 'ex' in modes:
+                    return modes['ex']
+            if self.suffixes:
+                lower = name.lower()
+                for length in self.suffix_lengths:
+                    color = self.suffixes.get(lower[-length:])
+                    if color is not None:
+                        return color
+        elif file_type == stat.S_IFDIR and modes:
+            sticky, writable = kind & stat.S_ISVTX, kind & stat.S_IWOTH
+            if sticky and writable and 'tw' in modes:
+                return modes['tw']
+            if writable and 'ow' in modes:
+                return modes['ow']
+            if sticky and 'st' in modes:
+                return modes['st']
+        return self.types.get(file_type, self.file_color)
 
 
 class Printing:
 
+    indent_width = 4
+
+    def __init__(self, writer: Optional[OutputWriter]=None, stats: Optional[Stats]=None):
+        self.writer = writer or OutputWriter()
+        self.stats = stats or Stats()
+
     @staticmethod
     def from_folder_to_list(folder: Folder)->list[File]:
         list_files = []
@@ -341,72 +1971,576 @@ class Printing:
         return list_files
 
     @staticmethod
-    def sort_by_size(files: list[File]) -> list[File]:
-        files.sort(key=lambda f: int(f.size), reverse=True)
-        return files
+    def escape_name(name: str)->str:
+        if name.isprintable() and "'" not in name and '\\' not in name:
+            return f"'{name}'"
+        return repr(name)
+
+    def paint_file(self, f: File, palette: 'LsColors', format_file: Callable[[File], str]=str)->str:
+        kind = f.kind if f.kind is not None else f.mode
+        if kind is None:
+            # Only records built outside a colored listing get here.
+            self.stats.stat_calls += 1
+            kind = os.lstat(f.full_path).st_mode
+        color = palette.color(kind, f.filename)
+        if not color:
+            return f'{format_file(f)} '
+        return f'{color}{format_file(f)}{palette.reset} '
+
+    def write_inline(self, list_names: Iterable[str], end=' ', intend=0)->None:
+        _intend = ' ' * intend
+        text = f'{end}{_intend}'.join(list_names)
+        if text:
+            self.writer.write(f'{_intend}{text}{end}')
+
+    def print_batches(self, args: Args, batches: Iterable[Batch])->None:
+        batches = iter(batches)
+        while True:
+            with self.stats.phase('collect'):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            self.print_files(args, self.from_folder_to_list(batch), intend=batch.depth * self.indent_width)
+            if batch.total is not None and batch.folder_details is None:
+                self.print_total(batch.total)
+            if self.writer.interactive:
+                self.writer.flush()
+
+    def print_total(self, total: int)->None:
+        self.writer.write(f'total {total}\n')
+
+    def print_header(self, path: str, first: bool)->None:
+        self.writer.write(f'{path}:\n' if first else f'\n{path}:\n')
+
+    def print_files(self, args: Args, list_fils: list[File], intend=0)->None:
+        self.stats.entries += len(list_fils)
+        sorter = Sorter.from_args(args)
+        if sorter:
+            with self.stats.phase('sort'):
+                list_fils = sorter.sort(list_fils)
+        with self.stats.phase('print'):
+            self.print_names(args, list_fils, intend)
+
+    def print_names(self, args: Args, list_fils: list[File], intend=0)->None:
+        plan = args.plan
+        format_file = plan.format_file
+        if plan.has(Flags.color):
+            names = (self.paint_file(f, plan.palette, format_file) for f in list_fils)
+        elif plan.has(Flags.escape):
+            names = (self.escape_name(format_file(f)) for f in list_fils)
+        else:
+            names = map(format_file, list_fils)
+        end_format = plan.row_end
+        return self.write_inline(names, end=end_format, intend=intend)
+
+
+class NdjsonPrinting(Printing):
+    """One JSON object per entry with raw values, written as each directory is collected.
+
+    type is 'dir', 'symlink' or 'file', read from mode: with --follow-symlinks a link
+    that resolves is described by what it points to, like its size and mode.
+    """
+
+    time_keys = {Flags.c: 'ctime_ns', Flags.u: 'atime_ns', None: 'mtime_ns'}
 
     @staticmethod
-    def escape_text(info_str: list[str])->list[str]:
-        escape_text = []
-        for name in info_str:
-            _name = repr(str(name))
-            escape_text.append(_name)
-        return escape_text
+    def kind(f: File)->str:
+        if f.mode is None:
+            return 'file'
+        return 'dir' if stat.S_ISDIR(f.mode) else 'symlink' if stat.S_ISLNK(f.mode) else 'file'
 
     @staticmethod
-    def print_inline(list_names: list[Union[File, str]], end=' ', intend=0)->None:
-        _intend = ' ' * intend
-        for f in list_names:
-            print(f'{_intend}{f}', end=end)
+    def relative_path(args: Args, f: File)->str:
+        if len(args.paths) > 1:
+            return f.full_path
+        return f.full_path[len(args.path.rstrip(os.sep)) + 1:]
+
+    def record(self, args: Args, f: File, depth: int)->dict:
+        record = {'path': self.relative_path(args, f), 'name': f.filename, 'depth': depth,
+                  'type': self.kind(f),
+                  'size': f.size, 'mode': f.mode, 'inode': f.inode,
+                  self.time_keys[args.plan.time_flag]: f.time}
+        if f.total is not None:
+            record['total'] = f.total
+        return record
+
+    def print_names(self, args: Args, list_fils: list[File], intend=0)->None:
+        depth = intend // self.indent_width
+        self.writer.write(''.join(json.dumps(self.record(args, f, depth)) + '\n' for f in list_fils))
+
+    def print_total(self, total: int)->None:
+        pass
+
+    def print_header(self, path: str, first: bool)->None:
+        pass
+
+
+class BinaryPrinting(NdjsonPrinting):
+    """Length-prefixed binary records.
+
+    The stream starts with b'LSPY', a version byte and the time kind byte (0 mtime,
+    1 ctime, 2 atime). Every record is a little-endian u32 length of the rest, then
+    depth u16, presence bits u8 (1 dir, 2 size, 4 time, 8 mode, 16 inode, 32 total, 64 symlink),
+    size i64, mode u32, inode u64, time ns i64, total i64, and the UTF-8 relative path.
+    """
+
+    magic = b'LSPY\x01'
+    time_kinds = {None: 0, Flags.c: 1, Flags.u: 2}
+    record_struct = struct.Struct('<IHBqIQqq')
+
+    def __init__(self, writer: Optional[OutputWriter]=None, stats: Optional[Stats]=None):
+        super().__init__(writer or OutputWriter(binary=True), stats)
+        self.started = False
+
+    def pack(self, args: Args, f: File, depth: int)->bytes:
+        path = self.relative_path(args, f).encode('utf-8', 'surrogateescape')
+        present = 0
+        for bit, value in enumerate((f.size, f.time, f.mode, f.inode, f.total), start=1):
+            if value is not None:
+                present |= 1 << bit
+        kind = self.kind(f)
+        if kind == 'dir':
+            present |= 1
+        elif kind == 'symlink':
+            present |= 64
+        header = self.record_struct.pack(self.record_struct.size - 4 + len(path), depth, present,
+                                         f.size or 0, f.mode or 0, f.inode or 0, f.time or 0, f.total or 0)
+        return header + path
+
+    def print_names(self, args: Args, list_fils: list[File], intend=0)->None:
+        if not self.started:
+            self.writer.write(self.magic + bytes([self.time_kinds[args.plan.time_flag]]))
+            self.started = True
+        depth = intend // self.indent_width
+        self.writer.write(b''.join(self.pack(args, f, depth) for f in list_fils))
+
+
+class PollingWatcher:
+    """Reports directories whose mtime changed since the last look."""
+
+    def __init__(self, interval: float=1.0):
+        self.interval = interval
+        self.mtimes = {}
 
     @staticmethod
-    def paint_folders(list_names: list[File], base='.')->list[str]:
-        painted = []
-        for f in list_names:
-            full_path = os.path.join(base, f.filename)
-            if os.path.isdir(full_path):
-                painted += [f'{Fore.BLUE}{str(f)}{Style.RESET_ALL} ']
+    def mtime(path: str)->Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def add(self, path: str)->None:
+        self.mtimes[path] = self.mtime(path)
+
+    def remove(self, path: str)->None:
+        self.mtimes.pop(path, None)
+
+    def wait(self)->set[str]:
+        time.sleep(self.interval)
+        changed = set()
+        for path, mtime in self.mtimes.items():
+            new_mtime = self.mtime(path)
+            if new_mtime != mtime:
+                self.mtimes[path] = new_mtime
+                changed.add(path)
+        return changed
+
+
+class InotifyWatcher:
+    """Linux inotify: sleeps in the kernel until a watched directory changes."""
+
+    IN_MODIFY, IN_ATTRIB, IN_MOVED_FROM, IN_MOVED_TO = 0x2, 0x4, 0x40, 0x80
+    IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF = 0x100, 0x200, 0x400, 0x800
+    mask = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    event = struct.Struct('iIII')
+    settle = 0.05
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = {}
+        self.watches = {}
+
+    def add(self, path: str)->None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.mask)
+        if wd < 0:
+            raise OSError(self.ctypes.get_errno(), f'cannot watch {path}')
+        self.paths[path] = wd
+        self.watches[wd] = path
+
+    def remove(self, path: str)->None:
+        wd = self.paths.pop(path, None)
+        if wd is not None and self.watches.pop(wd, None) is not None:
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self)->bytes:
+        data = b''
+        while True:
+            try:
+                data += os.read(self.fd, 65536)
+            except BlockingIOError:
+                return data
+
+    def wait(self)->set[str]:
+        select.select([self.fd], [], [])
+        time.sleep(self.settle)
+        data = self.read_events()
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.event.unpack_from(data, offset)
+            offset += self.event.size + length
+            if wd in self.watches:
+                changed.add(self.watches[wd])
+        return changed
+
+
+def directory_watcher()->Union[InotifyWatcher, PollingWatcher]:
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        return PollingWatcher()
+
+
+class WatchListing:
+    """Keeps a Folder tree live: only directories reported as changed are scanned again."""
+
+    clear_screen = '\x1b[2J\x1b[H'
+
+    def __init__(self, info: ScanInfoProvide, printing: Printing, args: Args,
+                 watcher: Union[InotifyWatcher, PollingWatcher]):
+        self.info = info
+        self.printing = printing
+        self.args = args
+        self.watcher = watcher
+        self.folders = {}
+        walk = info.new_walk(args)
+        self.root = Folder(folder_details=None,
+                           files_details=info.fill_folders(args, walk, info.scan_folder(args.path, args)))
+        self.track(args.path, self.root)
+
+    def track(self, path: str, folder: Folder)->None:
+        waiting = [(path, folder)]
+        while waiting:
+            path, folder = waiting.pop()
+            self.folders[path] = folder
+            self.watcher.add(path)
+            waiting.extend((item.folder_details.full_path, item) for item in folder.files_details or []
+                           if isinstance(item, Folder) and item.files_details is not None)
+
+    def untrack(self, path: str)->None:
+        waiting = [path]
+        while waiting:
+            path = waiting.pop()
+            folder = self.folders.pop(path, None)
+            self.watcher.remove(path)
+            if folder is not None:
+                waiting.extend(item.folder_details.full_path for item in folder.files_details or []
+                               if isinstance(item, Folder))
+
+    def depth(self, path: str)->int:
+        relative = os.path.relpath(path, self.args.path)
+        return 0 if relative == os.curdir else relative.count(os.sep) + 1
+
+    def walk_to(self, path: str)->Walk:
+        """A new walk for rescanning path, holding path and the folders above it so no link leads back up."""
+        walk = self.info.new_walk(self.args)
+        while path != self.args.path:
+            folder = self.folders.get(path)
+            if folder is not None and folder.visit is not None:
+                walk.first_visit(folder.visit)
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        return walk
+
+    def rescan(self, path: str)->None:
+        folder = self.folders.get(path)
+        if folder is None or not os.path.isdir(path):
+            return
+        old = {item.folder_details.filename: item for item in folder.files_details if isinstance(item, Folder)}
+        walk = self.walk_to(path)
+        # Read from disk: a file changed in place leaves the stamp a cached listing is checked by alone.
+        items = self.info.dedup(self.args, walk, self.info.read_folder(path, self.args))
+        depth = self.depth(path)
+        for item in items:
+            if not isinstance(item, Folder):
+                continue
+            kept = old.pop(item.folder_details.filename, None)
+            if kept is not None:
+                item.files_details = kept.files_details
             else:
-                painted += [f'{Fore.LIGHTWHITE_EX}{str(f)}{Style.RESET_ALL} ']
-        return painted
+                self.info.fill_folders(self.args, walk, [item], depth)
+            if item.files_details is None:
+                continue
+            if kept is not None:
+                self.folders[item.folder_details.full_path] = item
+            else:
+                self.track(item.folder_details.full_path, item)
+        for gone in old.values():
+            self.untrack(gone.folder_details.full_path)
+        folder.files_details = items
 
-    @staticmethod
-    def format_row(args: Args)->str:
-        if Flags.one in args.flags:
-            return '\n'
+    def render(self)->None:
+        """Prints the tree the way Listing does, totals summed afresh and the root's total line included."""
+        self.printing.writer.write(self.clear_screen)
+        self.printing.print_batches(self.args, self.info.tree_batches(self.args, None, self.root.files_details))
+        self.printing.writer.flush()
+
+    def run(self, refreshes: Optional[int]=None)->None:
+        self.render()
+        while refreshes is None or refreshes > 0:
+            changed = self.watcher.wait()
+            if not changed:
+                continue
+            for path in sorted(changed, key=len):
+                self.rescan(path)
+            self.render()
+            if refreshes is not None:
+                refreshes -= 1
+
+
+class Listing:
+    """One invocation over one or more paths, sharing one collection engine and its caches."""
+
+    def __init__(self, args: Args, stats: Optional[Stats]=None, shared_cache: Optional[SharedListingCache]=None):
+        self.args = args
+        self.stats = stats or Stats()
+        cache_path = args.cache or args.getenv('LS_PYTHON_CACHE')
+        # What --dedup drops depends on the rest of the walk, so those listings are never reused.
+        if Flags.no_cache in args.flags or Flags.dedup in args.flags:
+            self.cache = None
+        elif cache_path:
+            self.cache = ListingCache(cache_path)
         else:
-            return ' '
-
-    def _print(self,args: Args, info: Folder, intend=0)->None:
-        list_fils = self.from_folder_to_list(info)
-        if Flags.recursive in args.flags:
-            for f in info.files_details:
-                if isinstance(f, Folder):
-                    self._print(args, f, intend=intend+4)
-        if Flags.S in args.flags:
-            list_fils = self.sort_by_size(list_fils)
-        end_format = self.format_row(args)
-        final_list = []
-        if Flags.color in args.flags:
-            painted = self.paint_folders(list_fils, base=args.path)
-            final_list += painted
+            # A daemon's output must match a local run's: its own cache is never trusted with stat fields.
+            self.cache = None if args.plan.needs_stat else shared_cache
+        self.snapshot = SnapshotFS(args.from_snapshot) if args.from_snapshot else None
+        if Flags.asyncio in args.flags:
+            self.info = AsyncInfoProvide(args.jobs if args.jobs > 1 else AsyncInfoProvide.default_limit,
+                                         stats=self.stats)
+        elif args.jobs > 1:
+            self.info = ParallelScanInfoProvide(args.jobs, stats=self.stats)
         else:
-            final_list += list_fils
-        if Flags.escape in args.flags:
-            final_list = self.escape_text(final_list)
-        return self.print_inline(final_list, end=end_format, intend=intend)
+            self.info = ScanInfoProvide(stats=self.stats)
+
+    def use_path(self, path: str)->Args:
+        self.close_fs()
+        self.info.fs = self.snapshot or open_fs(path)
+        self.info.cache = self.cache if isinstance(self.info.fs, LocalFS) else None
+        return dc_replace(self.args, path=path)
+
+    def roots(self)->Iterator[tuple[Args, Iterator[Batch]]]:
+        paths = self.args.paths or [self.args.path]
+        for index, path in enumerate(paths):
+            path_args = self.use_path(path)
+            if Flags.dedup not in path_args.flags:
+                self.info.memo_roots = tuple(os.path.normpath(root) for root in paths[index + 1:])
+            yield path_args, self.info.iter_batches(path, path_args)
+        self.info.memo.clear()
+
+    def save_snapshot(self, target: str)->int:
+        return SnapshotWriter(self.info).save(self.use_path(self.args.path), target)
+
+    def close_fs(self)->None:
+        """Closes the descriptors the last root's LocalFS kept open."""
+        if isinstance(self.info.fs, LocalFS):
+            self.info.fs.close()
+
+    def close(self)->None:
+        self.close_fs()
+        if self.cache:
+            self.cache.close()
+        if self.snapshot:
+            self.snapshot.close()
+
 
+class FrameStream(io.RawIOBase):
+    """Sends everything written to it as frames of one channel of the ls_client protocol."""
 
-def main(argv: list)->None:
+    def __init__(self, connection: 'socket.socket', channel: int):
+        super().__init__()
+        import ls_client
+        self.protocol = ls_client
+        self.connection = connection
+        self.channel = channel
+
+    def writable(self)->bool:
+        return True
+
+    def write(self, data: bytes)->int:
+        self.protocol.send_frame(self.connection, self.channel, bytes(data))
+        return len(data)
+
+    def text(self)->io.TextIOWrapper:
+        return io.TextIOWrapper(io.BufferedWriter(self, OutputWriter.chunk_size), encoding='utf-8',
+                                errors='surrogateescape', newline='\n')
+
+
+class ListingServer:
+    """--serve: lists for ls_client over a Unix socket, one thread per request.
+
+    Requests share the daemon's warm state: listings in a SharedListingCache, and
+    compiled plans, time strings and LS_COLORS tables in their lru_caches, keyed
+    on the LS_COLORS and TZ each client sends. Everything else belongs to the
+    request, so any number run at once.
+    """
+
+    def __init__(self, path: str, cache: Optional[SharedListingCache]=None):
+        import socket
+        self.socket = socket
+        self.path = path
+        self.cache = cache or SharedListingCache()
+
+    def bind(self)->'socket.socket':
+        if os.path.lexists(self.path):
+            # Only a socket left behind by a daemon that died is replaced, never anything else at the path.
+            if not stat.S_ISSOCK(os.lstat(self.path).st_mode):
+                raise ValueError(f'{self.path} exists and is not a socket')
+            probe = self.socket.socket(self.socket.AF_UNIX, self.socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except ConnectionRefusedError:
+                os.unlink(self.path)
+            else:
+                raise ValueError(f'a daemon already serves {self.path}')
+            finally:
+                probe.close()
+        server = self.socket.socket(self.socket.AF_UNIX, self.socket.SOCK_STREAM)
+        # The daemon lists whatever it can read, so only its own user may ask: the socket is created 0600.
+        umask = os.umask(0o177)
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(umask)
+        server.listen(64)
+        return server
+
+    def serve_forever(self)->None:
+        server = self.bind()
+        if threading.current_thread() is threading.main_thread():
+            import signal
+            # Stopped by a service manager, the daemon still removes its socket.
+            signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit(0))
+        try:
+            while True:
+                connection, _address = server.accept()
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.unlink(self.path)
+
+    def handle(self, connection: 'socket.socket')->None:
+        import ls_client
+        with connection:
+            try:
+                request = json.loads(connection.makefile('rb').readline())
+                stream = FrameStream(connection, ls_client.STDOUT).text()
+                error_stream = FrameStream(connection, ls_client.STDERR).text()
+                status = 0
+                try:
+                    main(request['argv'], stream=stream, error_stream=error_stream, cwd=request['cwd'],
+                         interactive=request['interactive'], shared_cache=self.cache,
+                         environ=request.get('environ'))
+                except Exception as error:
+                    error_stream.write(f'ls_python: {error}\n')
+                    status = 1
+                stream.flush()
+                error_stream.flush()
+                ls_client.send_frame(connection, ls_client.STATUS, bytes([status]))
+            except OSError:
+                # The client went away; its listing is simply dropped.
+                pass
+
+
+def iter_entries(paths: Iterable[str], flags: Iterable[str]=())->Iterator[tuple[str, int, File]]:
+    """Lists paths in-process, yielding (root, depth, File) in listing order.
+
+    flags are spelled as on the command line, e.g. ['-l', '-R', '--sort=size'].
+    Nothing is printed, so the caller's terminal never adds --color.
+    """
+    check_flags = CheckFlags()
+    args = Argv(AutoFlags(check_flags, interactive=False), check_flags).parse_argv(['ls_python', *flags, *paths])
+    listing = Listing(args)
+    try:
+        for path_args, batches in listing.roots():
+            sorter = Sorter.from_args(path_args)
+            for batch in batches:
+                files = Printing.from_folder_to_list(batch)
+                for f in sorter.sort(files) if sorter else files:
+                    yield path_args.path, batch.depth, f
+    finally:
+        listing.close()
+
+
+def main(argv: list, stats: Optional[Stats]=None, stream=None, error_stream=None, cwd: Optional[str]=None,
+         interactive: Optional[bool]=None, shared_cache: Optional[SharedListingCache]=None,
+         environ: Optional[dict]=None)->None:
+    """Runs one listing; pass a Stats to read its phase timings and counters afterwards.
+
+    A --serve daemon passes the request's output streams, working directory,
+    terminal state and environment, and its warm cache.
+    """
+    stats = stats or Stats()
     check_flags = CheckFlags()
-    auto_flags = AutoFlags(check_flags)
+    auto_flags = AutoFlags(check_flags, interactive)
     args = Argv(auto_flags, check_flags)
-    info = InfoProvide()
-    printing = Printing()
-    _args = args.parse_argv(argv)
-    to_info = info.provide_files(_args.path, _args)
-    _info = info.info_for_print(_args, to_info)
-    printing._print(_args, _info)
+    with stats.phase('parse'):
+        _args = args.parse_argv(argv, cwd, environ)
+    if cwd is not None and (_args.serve or Flags.watch in _args.flags):
+        raise ValueError('--serve and --watch run on their own, not through a daemon')
+    if _args.serve:
+        ListingServer(_args.serve).serve_forever()
+        return
+    writer = OutputWriter(stream, binary=_args.format == 'binary')
+    if _args.format == 'ndjson':
+        printing = NdjsonPrinting(writer, stats=stats)
+    elif _args.format == 'binary':
+        printing = BinaryPrinting(writer, stats=stats)
+    else:
+        printing = Printing(writer, stats=stats)
+    listing = Listing(_args, stats, shared_cache)
+    try:
+        if _args.save_snapshot:
+            with stats.phase('collect'):
+                listing.save_snapshot(_args.save_snapshot)
+        elif Flags.watch in _args.flags:
+            WatchListing(listing.info, printing, listing.use_path(_args.path), directory_watcher()).run()
+        else:
+            for index, (path_args, batches) in enumerate(listing.roots()):
+                if len(_args.paths) > 1:
+                    printing.print_header(path_args.path, index == 0)
+                printing.print_batches(path_args, batches)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        printing.writer.flush()
+        listing.close()
+        stats.bytes_written = printing.writer.bytes_written
+        if _args.stats:
+            stats.report(_args.stats, error_stream)
+
+
+def remote_main(argv: list)->Optional[int]:
+    """Runs argv on the --serve daemon named by --connect or LS_PYTHON_SOCKET; None when there is none to ask."""
+    if not any(arg.startswith('--connect') for arg in argv) and 'LS_PYTHON_SOCKET' not in os.environ:
+        return None
+    import ls_client
+    path = ls_client.socket_path(argv)
+    return ls_client.request(path, argv) if path and ls_client.servable(argv) else None
+
 
 if __name__ == '__main__':
-    main(sys.argv)
+    status = remote_main(sys.argv)
+    if status is None:
+        main(sys.argv)
+    else:
+        sys.exit(status)
@@ -0,0 +1,42 @@
+"""Fixtures shared by the ls_python tests: trees on the real file system and an in-process ls."""
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ls_python  # noqa: E402
+
+
+@pytest.fixture
+def ls():
+    """Runs ls_python.main on argv and returns what it printed."""
+    def run(*argv, **kwargs)->str:
+        stream = io.StringIO()
+        ls_python.main(['ls_python.py', *map(str, argv)], stream=stream, interactive=False, **kwargs)
+        return stream.getvalue()
+    return run
+
+
+@pytest.fixture
+def linked_tree(tmp_path)->str:
+    """Folders reached more than once through symlinks, a symlink loop and a file with 40 hard links."""
+    root = tmp_path / 'tree'
+    (root / 'mixed').mkdir(parents=True)
+    (root / 'mixed' / 'f4.txt').write_text('mixed\n')
+    (root / 'mixed' / 'wl').symlink_to('../wide')
+    (root / 'h').mkdir()
+    (root / 'h' / 'h1').write_text('linked\n')
+    for index in range(2, 41):
+        os.link(root / 'h' / 'h1', root / 'h' / f'h{index}')
+    for index in range(20):
+        folder = root / 'wide' / f'd{index}'
+        (folder / 's').mkdir(parents=True)
+        (folder / 'f').write_text(f'{index}\n')
+        (folder / 's' / 'back').symlink_to('../../../mixed')
+        os.link(root / 'h' / 'h1', folder / f'x{index}')
+    (root / 'loop').mkdir()
+    (root / 'loop' / 'self').symlink_to('..')
+    return str(root)
@@ -0,0 +1,32 @@
+"""Paths inside an archive are checked against its members before they are listed."""
+import os
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def archive(tmp_path)->str:
+    path = str(tmp_path / 'tree.zip')
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('tree/a/f1', 'one')
+        zf.writestr('tree/a/b/f2', 'two')
+        zf.writestr('tree/top', 'top')
+    return path
+
+
+def test_inner_folder_is_listed(ls, archive):
+    assert sorted(ls('--one', os.path.join(archive, 'tree', 'a')).split()) == ['b', 'f1']
+    assert ls('--one', os.path.join(archive, 'tree', 'a', 'b')).split() == ['f2']
+
+
+@pytest.mark.parametrize('inner', ['missing', 'tree/missing', 'tree/a/b/f2/deeper'])
+def test_missing_inner_path_is_an_invalid_path(ls, archive, inner):
+    path = os.path.join(archive, *inner.split('/'))
+    with pytest.raises(ValueError, match=f'invalid path {path}'):
+        ls(path)
+
+
+def test_member_file_is_not_a_folder(ls, archive):
+    with pytest.raises(NotADirectoryError):
+        ls(os.path.join(archive, 'tree', 'top'))
@@ -0,0 +1,105 @@
+"""Cached listings never hide a change a fresh listing would show."""
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+import ls_python
+
+package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(script: str, *argv)->str:
+    result = subprocess.run([sys.executable, os.path.join(package, script), *map(str, argv)],
+                            capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def settle(*paths)->None:
+    """Dates paths an hour back, so a cache does not take their listings for racy ones."""
+    past = time.time() - 3600
+    for path in paths:
+        os.utime(path, (past, past))
+
+
+@pytest.fixture
+def folder(tmp_path)->str:
+    root = tmp_path / 'mixed'
+    root.mkdir()
+    (root / 'f4.txt').write_text('x' * 25)
+    (root / 'sub').mkdir()
+    (root / 'sub' / 'g').write_text('g')
+    settle(root, root / 'sub')
+    return str(root)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    path = str(tmp_path / 'ls.sock')
+    server = subprocess.Popen([sys.executable, os.path.join(package, 'ls_python.py'), f'--serve={path}'])
+    deadline = time.monotonic() + 10
+    while not os.path.exists(path):
+        assert server.poll() is None and time.monotonic() < deadline
+        time.sleep(0.05)
+    yield path
+    server.terminate()
+    server.wait()
+
+
+def test_daemon_sees_a_file_rewritten_in_place(folder, daemon):
+    assert 'f4.txt 25' in run('ls_client.py', f'--connect={daemon}', '-l', '-R', folder)
+    with open(os.path.join(folder, 'f4.txt'), 'a') as f:
+        f.write('y' * 20)
+    served = run('ls_client.py', f'--connect={daemon}', '-l', '-R', folder)
+    assert 'f4.txt 45' in served
+    assert served == run('ls_python.py', '-l', '-R', folder)
+
+
+def test_daemon_sees_a_new_file(folder, daemon):
+    run('ls_client.py', f'--connect={daemon}', '-R', folder)
+    open(os.path.join(folder, 'sub', 'new'), 'w').close()
+    served = run('ls_client.py', f'--connect={daemon}', '-R', folder)
+    assert 'new' in served.split()
+    assert served == run('ls_python.py', '-R', folder)
+
+
+def test_cache_sees_files_added_and_removed(ls, folder, tmp_path):
+    cache = tmp_path / 'cache.db'
+    assert ls('-R', '-l', f'--cache={cache}', folder) == ls('-R', '-l', '--no-cache', folder)
+    open(os.path.join(folder, 'sub', 'new'), 'w').close()
+    os.remove(os.path.join(folder, 'f4.txt'))
+    cached = ls('-R', '-l', f'--cache={cache}', folder)
+    assert 'new' in cached.split() and 'f4.txt' not in cached.split()
+    assert cached == ls('-R', '-l', '--no-cache', folder)
+
+
+def test_cache_is_served_on_the_next_run(ls, folder, tmp_path):
+    cache = tmp_path / 'cache.db'
+    ls('-R', '-l', f'--cache={cache}', folder)
+    stats = ls_python.Stats()
+    assert ls('-R', '-l', f'--cache={cache}', folder, stats=stats) == ls('-R', '-l', '--no-cache', folder)
+    assert stats.dir_reads == 0
+
+
+def test_a_busy_cache_is_a_miss(ls, folder, tmp_path):
+    cache = tmp_path / 'cache.db'
+    ls('-R', f'--cache={cache}', folder)
+    holder = sqlite3.connect(cache, isolation_level=None)
+    holder.execute('BEGIN EXCLUSIVE')
+    try:
+        assert ls('-R', '-l', f'--cache={cache}', folder) == ls('-R', '-l', '--no-cache', folder)
+    finally:
+        holder.execute('ROLLBACK')
+        holder.close()
+
+
+def test_listings_share_a_cache_file(folder, tmp_path):
+    cache = tmp_path / 'cache.db'
+    argv = [sys.executable, os.path.join(package, 'ls_python.py'), '-R', '-l', f'--cache={cache}', folder]
+    runs = [subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) for _ in range(4)]
+    outputs = [run.communicate() for run in runs]
+    assert all(run.returncode == 0 for run in runs)
+    assert {stdout for stdout, _stderr in outputs} == {run('ls_python.py', '-R', '-l', '--no-cache', folder)}
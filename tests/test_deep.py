@@ -0,0 +1,53 @@
+"""A tree deeper than PATH_MAX allows for a full path lists on the real file system."""
+import os
+
+import pytest
+
+depth = 3000
+
+
+def make_chain(root: str, levels: int)->None:
+    """root/d/d/... levels deep, with a file f on every level, created through descriptors."""
+    fd = os.open(root, os.O_RDONLY)
+    try:
+        for level in range(levels):
+            os.mkdir('d', dir_fd=fd)
+            os.close(os.open('f', os.O_WRONLY | os.O_CREAT, dir_fd=fd))
+            child = os.open('d', os.O_RDONLY, dir_fd=fd)
+            os.close(fd)
+            fd = child
+    finally:
+        os.close(fd)
+
+
+def remove_chain(root: str)->None:
+    """Removes the chain a level at a time, moving the rest up so every path stays short."""
+    top = os.path.join(root, 'd')
+    rest = os.path.join(root, 'rest')
+    while os.path.isdir(top):
+        if os.path.exists(os.path.join(top, 'f')):
+            os.remove(os.path.join(top, 'f'))
+        if os.path.isdir(os.path.join(top, 'd')):
+            os.rename(os.path.join(top, 'd'), rest)
+            os.rmdir(top)
+            os.rename(rest, top)
+        else:
+            os.rmdir(top)
+
+
+@pytest.fixture
+def deep_tree(tmp_path)->str:
+    root = str(tmp_path / 'deep')
+    os.mkdir(root)
+    make_chain(root, depth)
+    yield root
+    remove_chain(root)
+
+
+@pytest.mark.skipif(os.scandir not in os.supports_fd, reason='lists long paths through descriptors')
+@pytest.mark.parametrize('engine', [[], ['--jobs=4'], ['--asyncio']])
+def test_deep_tree_lists_every_level(ls, deep_tree, engine):
+    lines = ls('-R', '--one', '-s', '--total', *engine, deep_tree).splitlines()
+    assert len(os.path.join(deep_tree, *['d'] * depth)) > 4096
+    assert sum(line.strip().startswith('d ') for line in lines) == depth
+    assert sum(line.strip() == 'f 0' for line in lines) == depth
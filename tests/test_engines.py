@@ -0,0 +1,40 @@
+"""Every collection engine prints the same listing, byte for byte."""
+import pytest
+
+engines = (['--jobs=2'], ['--jobs=4'], ['--asyncio'])
+
+
+@pytest.mark.parametrize('options', [
+    ['-R'],
+    ['-R', '--follow-symlinks'],
+    ['-R', '--follow-symlinks', '--max-depth=3', '-l'],
+    ['-R', '--dedup'],
+    ['-R', '--dedup', '--follow-symlinks', '-l'],
+    ['-R', '--dedup', '--follow-symlinks', '--total', '-s'],
+])
+def test_engines_print_the_same(ls, linked_tree, options):
+    serial = ls(*options, linked_tree)
+    for engine in engines:
+        # Scans finish in a different order on every run; the output must not follow it.
+        for _ in range(3):
+            assert ls(*options, *engine, linked_tree) == serial
+
+
+@pytest.mark.parametrize('engine', [[], *engines])
+def test_dedup_lists_a_hard_link_once(ls, linked_tree, engine):
+    names = ls('--one', '-R', '--dedup', *engine, linked_tree).split()
+    links = {f'h{index}' for index in range(1, 41)} | {f'x{index}' for index in range(20)}
+    assert len([name for name in names if name in links]) == 1
+
+
+@pytest.mark.parametrize('options', [['-R', '--max-depth=2'], ['-R', '-s', '--total']])
+def test_roots_inside_roots_print_the_same(ls, tmp_path, options):
+    (tmp_path / 'a' / 'b' / 'c' / 'd').mkdir(parents=True)
+    (tmp_path / 'a' / 'cf').mkdir()
+    (tmp_path / 'a' / 'b' / 'c' / 'f').write_text('f\n')
+    roots = (tmp_path / 'a', tmp_path)
+    expected = ''.join(ls(*options, '--no-cache', root) for root in roots)
+    for engine in ([], *engines):
+        printed = ls(*options, *engine, *roots)
+        assert [line for line in printed.splitlines() if line and not line.endswith(':')] == \
+            [line for line in expected.splitlines() if line]
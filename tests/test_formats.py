@@ -0,0 +1,38 @@
+"""--format=ndjson and --format=binary tell folders, files and symlinks apart."""
+import io
+import json
+
+import pytest
+
+import ls_python
+
+
+@pytest.fixture
+def typed(tmp_path)->str:
+    (tmp_path / 'folder').mkdir()
+    (tmp_path / 'file').write_text('file\n')
+    (tmp_path / 'link').symlink_to('file')
+    (tmp_path / 'dangling').symlink_to('nowhere')
+    return str(tmp_path)
+
+
+def test_ndjson_types(ls, typed):
+    records = [json.loads(line) for line in ls('--format=ndjson', typed).splitlines()]
+    assert {record['name']: record['type'] for record in records} == \
+        {'folder': 'dir', 'file': 'file', 'link': 'symlink', 'dangling': 'symlink'}
+
+
+def test_binary_presence_bits(typed):
+    stream = io.BytesIO()
+    ls_python.main(['ls_python.py', '--format=binary', typed], stream=stream, interactive=False)
+    data = stream.getvalue()
+    assert data.startswith(ls_python.BinaryPrinting.magic)
+    record = ls_python.BinaryPrinting.record_struct
+    offset = len(ls_python.BinaryPrinting.magic) + 1
+    kinds = {}
+    while offset < len(data):
+        length, _depth, present, *_values = record.unpack_from(data, offset)
+        name = data[offset + record.size:offset + 4 + length].decode()
+        kinds[name] = present & (1 | 64)
+        offset += 4 + length
+    assert kinds == {'folder': 1, 'file': 0, 'link': 64, 'dangling': 64}
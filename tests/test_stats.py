@@ -0,0 +1,25 @@
+"""--stats counts the syscalls a listing makes, as benchmark.SyscallCounter sees them."""
+import io
+
+import pytest
+
+import benchmark
+import ls_python
+
+
+def counted(flags: list, path: str)->tuple[int, int]:
+    """(syscalls counted at the os module, dir reads plus stat calls --stats reports)."""
+    stats = ls_python.Stats()
+    counter = benchmark.SyscallCounter()
+    with counter.active():
+        ls_python.main(['ls_python.py', *flags, path], stats=stats, stream=io.StringIO(), interactive=False)
+    return counter.count, stats.dir_reads + stats.stat_calls
+
+
+@pytest.mark.parametrize('flags', [['--dedup'], ['-R', '--dedup'], ['-R', '--dedup', '--jobs=2'], ['-R', '-l']])
+def test_stats_count_every_stat(linked_tree, flags):
+    # Checking the path before the listing costs the same few calls whatever the flags.
+    syscalls, reported = counted(['-R'], linked_tree)
+    overhead = syscalls - reported
+    syscalls, reported = counted(flags, linked_tree)
+    assert syscalls - reported == overhead
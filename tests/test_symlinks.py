@@ -0,0 +1,34 @@
+"""Dangling and looping symlinks are listed as links, never followed into an error."""
+import pytest
+
+
+@pytest.fixture
+def broken_links(tmp_path)->str:
+    (tmp_path / 'dangling').symlink_to('nowhere')
+    (tmp_path / 'loop1').symlink_to('loop2')
+    (tmp_path / 'loop2').symlink_to('loop1')
+    (tmp_path / 'file').write_text('text\n')
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize('options', [
+    ['--follow-symlinks', '-l'],
+    ['--dedup'],
+    ['--dedup', '--follow-symlinks', '-l'],
+    ['-R', '--follow-symlinks', '-l', '--jobs=2'],
+    ['-R', '--follow-symlinks', '--dedup', '--asyncio'],
+])
+def test_broken_links_are_listed(ls, broken_links, options):
+    lines = ls('--one', *options, broken_links).splitlines()
+    for name in ('dangling', 'loop1', 'loop2'):
+        assert any(line.startswith(name) for line in lines)
+
+
+def test_looping_links_are_not_folders(ls, broken_links):
+    assert ls('--one', '-d', broken_links).split() == []
+
+
+def test_dangling_link_shows_the_link_itself(ls, broken_links):
+    lines = ls('--follow-symlinks', '-l', broken_links).splitlines()
+    dangling = next(line for line in lines if line.startswith('dangling'))
+    assert dangling.endswith('lrwxrwxrwx')
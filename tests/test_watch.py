@@ -0,0 +1,58 @@
+"""--watch redraws what a fresh listing of the same tree would print."""
+import io
+import os
+import time
+
+import ls_python
+
+
+class StillWatcher:
+    """A watcher that reports nothing; the tests call rescan themselves."""
+
+    def add(self, path: str)->None:
+        pass
+
+    def remove(self, path: str)->None:
+        pass
+
+
+def watch(argv: list)->tuple[ls_python.WatchListing, io.StringIO]:
+    check_flags = ls_python.CheckFlags()
+    args = ls_python.Argv(ls_python.AutoFlags(check_flags, False), check_flags).parse_argv(['ls_python.py', *argv])
+    listing = ls_python.Listing(args)
+    stream = io.StringIO()
+    printing = ls_python.Printing(ls_python.OutputWriter(stream))
+    return ls_python.WatchListing(listing.info, printing, listing.use_path(args.path), StillWatcher()), stream
+
+
+def last_frame(stream: io.StringIO)->str:
+    return stream.getvalue().split(ls_python.WatchListing.clear_screen)[-1]
+
+
+def test_rescan_reads_a_file_changed_in_place(ls, tmp_path):
+    root = tmp_path / 'tree'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'sub' / 'f').write_text('ab')
+    past = time.time() - 3600
+    os.utime(root / 'sub', (past, past))
+    argv = ['-R', '-l', '--total', f'--cache={tmp_path / "cache.db"}', str(root)]
+    ls(*argv)
+    listing, stream = watch(argv)
+    (root / 'sub' / 'f').write_text('abcdefghijkl')
+    os.utime(root / 'sub', (past, past))
+    listing.rescan(str(root / 'sub'))
+    listing.render()
+    frame = last_frame(stream)
+    assert 'f 12' in frame
+    assert frame == ls('-R', '-l', '--total', '--no-cache', root)
+
+
+def test_render_prints_the_root_total(ls, tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'x').write_text('x' * 100)
+    (tmp_path / 'y').write_text('yy')
+    listing, stream = watch(['-R', '-s', '--total', str(tmp_path)])
+    listing.render()
+    frame = last_frame(stream)
+    assert frame.splitlines()[-1].startswith('total ')
+    assert frame == ls('-R', '-s', '--total', tmp_path)